@@ -0,0 +1,166 @@
+#!/usr/bin/python2
+# Script Name: backendstartup.py
+# Script Function:
+#	This script measures how long the pharos backend takes to start so that startup
+#	regressions show up. It times:
+#	1. Backend discovery (no arguments), which CUPS runs for every lpinfo -v
+#	2. Job startup up to the popup server connection, with a cold and a warm config cache
+#	3. Loading pharos.conf and configuring logging inside one process
+#	4. Logging a burst of DEBUG and INFO records, which stay in the in-memory ring buffer
+#
+# Usage:
+#	$python benchmarks/backendstartup.py [--runs N] [--max-discovery-ms MS] [--max-startup-ms MS]
+#		Exits with status 1 when a median exceeds the given budget
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+# Imports ===============================
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import optparse
+
+# Script Variables ======================
+packageDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+backendFile = os.path.join(packageDIR, 'pharos')
+configFile = os.path.join(packageDIR, 'pharos.conf')
+
+# Functions =============================
+def median(values):
+	"""
+	Returns the median of a list of numbers
+	"""
+	values = sorted(values)
+	middle = len(values) // 2
+	if len(values) % 2:
+		return values[middle]
+	return (values[middle - 1] + values[middle]) / 2.0
+
+def createBenchmarkConfig(workDIR):
+	"""
+	Writes a copy of pharos.conf that logs into workDIR and points the popup server at a closed port.
+	The backend gives up on the unreachable popup server at once instead of retrying it
+	"""
+	benchmarkConfig = os.path.join(workDIR, 'pharos.conf')
+	source = open(configFile, 'r').read()
+	source = source.replace('/var/log/pharos', workDIR)
+	source = source.replace('port=28203', 'port=1')
+	source = re.sub(r'(?m)^retrydeadline=.*$', 'retrydeadline=0', source)
+	source = re.sub(r'(?m)^unreachable=.*$', 'unreachable=fail', source)
+	configHandle = open(benchmarkConfig, 'w')
+	configHandle.write(source)
+	configHandle.close()
+	return benchmarkConfig
+
+def createFileConfigConfig(workDIR, benchmarkConfig):
+	"""
+	Writes a copy of the benchmark config that logging.config.fileConfig can load, with the
+	shared rotating handlers replaced by plain FileHandlers
+	"""
+	fileConfigConfig = os.path.join(workDIR, 'fileconfig.conf')
+	source = open(benchmarkConfig, 'r').read()
+	source = re.sub(r"class=SharedRotatingFileHandler(\s+(?:\w+=.*\s+)*?)args=\(('[^']*')[^\n]*", r"class=FileHandler\1args=(\2, 'a')", source)
+	configHandle = open(fileConfigConfig, 'w')
+	configHandle.write(source)
+	configHandle.close()
+	return fileConfigConfig
+
+def timeBackend(runs, arguments, environment, coldCache=None):
+	"""
+	Runs the backend runs times and returns the wall clock times in milliseconds
+	"""
+	times = []
+	devnull = open(os.devnull, 'r+')
+	for run in range(runs):
+		if coldCache and os.path.exists(coldCache):
+			os.remove(coldCache)
+		start = time.time()
+		subprocess.call([sys.executable, backendFile] + arguments, env=environment, stdin=devnull, stdout=devnull, stderr=devnull)
+		times.append((time.time() - start) * 1000.0)
+	devnull.close()
+	return times
+
+def timeInProcess(runs, function):
+	"""
+	Calls function runs times and returns the times in milliseconds
+	"""
+	times = []
+	for run in range(runs):
+		start = time.time()
+		function()
+		times.append((time.time() - start) * 1000.0)
+	return times
+
+def main():
+	"""
+	Runs the benchmarks and prints the median of each
+	"""
+	parser = optparse.OptionParser()
+	parser.add_option('--runs', type='int', default=20, help='number of runs per measurement')
+	parser.add_option('--max-discovery-ms', type='float', default=0, help='fail when discovery takes longer')
+	parser.add_option('--max-startup-ms', type='float', default=0, help='fail when warm job startup takes longer')
+	options, args = parser.parse_args()
+
+	workDIR = tempfile.mkdtemp(prefix='pharosbench')
+	try:
+		benchmarkConfig = createBenchmarkConfig(workDIR)
+		fileConfigConfig = createFileConfigConfig(workDIR, benchmarkConfig)
+		environment = dict(os.environ)
+		environment['PHAROS_CONFIG_FILE'] = benchmarkConfig
+		environment['PHAROS_CACHE_DIR'] = workDIR
+		environment['DEVICE_URI'] = 'pharos://127.0.0.1/benchmark'
+		jobArguments = ['1', 'benchmark', 'benchmark job', '1', '']
+
+		sys.path.insert(0, packageDIR)
+		from pharosconfig import PharosConfig
+		from pharoslogging import configureLogging
+		cachePath = PharosConfig(benchmarkConfig, workDIR).cachePath
+
+		results = []
+		results.append(('backend discovery', median(timeBackend(options.runs, [], environment))))
+		results.append(('job startup, cold cache', median(timeBackend(options.runs, jobArguments, environment, coldCache=cachePath))))
+		results.append(('job startup, warm cache', median(timeBackend(options.runs, jobArguments, environment))))
+
+		def parseConfig():
+			PharosConfig(benchmarkConfig, workDIR).parse()
+		def loadCachedConfig():
+			PharosConfig(benchmarkConfig, workDIR).load()
+		def fileConfigLogging():
+			import logging.config
+			logging.config.fileConfig(fileConfigConfig)
+		def cachedConfigLogging():
+			configureLogging(PharosConfig(benchmarkConfig, workDIR).load(), 'pharos')
+		results.append(('parse pharos.conf', median(timeInProcess(options.runs, parseConfig))))
+		results.append(('load cached pharos.conf', median(timeInProcess(options.runs, loadCachedConfig))))
+		results.append(('logging.config.fileConfig', median(timeInProcess(options.runs, fileConfigLogging))))
+		results.append(('configureLogging from cache', median(timeInProcess(options.runs, cachedConfigLogging))))
+
+		benchmarkLogger = configureLogging(PharosConfig(benchmarkConfig, workDIR).load(), 'pharos')
+		def logBurst():
+			for index in range(1000):
+				benchmarkLogger.debug('Benchmark record %d' %index)
+				benchmarkLogger.info('Benchmark record %d' %index)
+		results.append(('2000 buffered log records', median(timeInProcess(options.runs, logBurst))))
+	finally:
+		shutil.rmtree(workDIR)
+
+	for name, milliseconds in results:
+		print('%-30s %8.2f ms' %(name, milliseconds))
+
+	failed = False
+	if options.max_discovery_ms and results[0][1] > options.max_discovery_ms:
+		print('Backend discovery exceeded the %.2f ms budget' %options.max_discovery_ms)
+		failed = True
+	if options.max_startup_ms and results[2][1] > options.max_startup_ms:
+		print('Warm job startup exceeded the %.2f ms budget' %options.max_startup_ms)
+		failed = True
+	if failed:
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
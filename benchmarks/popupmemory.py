@@ -0,0 +1,153 @@
+#!/usr/bin/python2
+# Script Name: popupmemory.py
+# Script Function:
+#	This script measures the resident memory (RSS) of the pharos popup server, which runs
+#	in every desktop session. It measures:
+#	1. The idle popup server, a socket listener that has not loaded wx
+#	2. The popup server and its GUI process while a popup is shown
+#	3. A process that imports wx and creates a wx.App, what an idle popup server
+#	   that loaded wx itself would hold all day
+#	The GUI needs a display, run it inside a desktop session or under Xvfb
+#
+# Usage:
+#	$python benchmarks/popupmemory.py [--max-idle-kb KB]
+#		Exits with status 1 when the idle popup server exceeds the given budget
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+# Imports ===============================
+import os
+import sys
+import time
+import shutil
+import socket
+import tempfile
+import subprocess
+import optparse
+
+# Script Variables ======================
+packageDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+popupServerFile = os.path.join(packageDIR, 'pharospopup')
+configFile = os.path.join(packageDIR, 'pharos.conf')
+
+sys.path.insert(0, packageDIR)
+from popupprotocol import getSessionSocketPath, MessageChannel, ProtocolError, REQUEST_STATUS, REQUEST_PRINT_JOB_PARAMETERS
+
+# Functions =============================
+def createBenchmarkConfig(workDIR):
+	"""
+	Writes a copy of pharos.conf that logs into workDIR and only listens on the session socket
+	"""
+	benchmarkConfig = os.path.join(workDIR, 'pharos.conf')
+	source = open(configFile, 'r').read()
+	source = source.replace('/var/log/pharos', workDIR)
+	source = source.replace('tcpfallback=yes', 'tcpfallback=no')
+	source = source.replace('socket=/run/pharos/broker.sock', 'socket=%s' %os.path.join(workDIR, 'broker.sock'))
+	configHandle = open(benchmarkConfig, 'w')
+	configHandle.write(source)
+	configHandle.close()
+	return benchmarkConfig
+
+def getStatus(socketPath):
+	"""
+	Returns the Status reply of the popup server, or None when it does not answer
+	"""
+	s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	channel = MessageChannel(None, s, 5)
+	try:
+		s.connect(socketPath)
+		channel.send({'type': REQUEST_STATUS})
+		return channel.receive()
+	except (socket.error, ProtocolError):
+		return None
+	finally:
+		channel.close()
+
+def waitForStatus(socketPath, condition, timeout):
+	"""
+	Polls the popup server status until condition is true for it and returns it, or None on timeout
+	"""
+	deadline = time.time() + timeout
+	while time.time() < deadline:
+		status = getStatus(socketPath)
+		if status and condition(status):
+			return status
+		time.sleep(0.2)
+	return None
+
+def measureInProcessWx():
+	"""
+	Returns the RSS in KB of a process that imported wx and created a wx.App, or None
+	"""
+	script = "import wx\napp = wx.App(False)\nfor line in open('/proc/self/status'):\n\tif line.startswith('VmRSS:'):\n\t\tprint line.split()[1]\n"
+	process = subprocess.Popen([sys.executable, '-c', script], stdout=subprocess.PIPE, stderr=open(os.devnull, 'w'))
+	output = process.communicate()[0].strip()
+	if process.returncode != 0 or not output.isdigit():
+		return None
+	return int(output)
+
+def main():
+	"""
+	Runs the measurements and prints them
+	"""
+	parser = optparse.OptionParser()
+	parser.add_option('--max-idle-kb', type='int', default=0, help='fail when the idle popup server uses more')
+	options, args = parser.parse_args()
+
+	workDIR = tempfile.mkdtemp(prefix='pharosbench')
+	results = []
+	server = None
+	try:
+		environment = dict(os.environ)
+		environment['PHAROS_CONFIG_FILE'] = createBenchmarkConfig(workDIR)
+		environment['PHAROS_CACHE_DIR'] = workDIR
+		environment['XDG_RUNTIME_DIR'] = workDIR
+		environment['XDG_SESSION_ID'] = 'benchmark'
+		environment['HOME'] = workDIR
+		environment['PYTHONPATH'] = packageDIR
+		os.environ['XDG_RUNTIME_DIR'] = workDIR
+		socketPath = getSessionSocketPath(os.getuid(), 'benchmark')
+		devnull = open(os.devnull, 'r+')
+		server = subprocess.Popen([sys.executable, popupServerFile], env=environment, stdin=devnull, stdout=devnull, stderr=devnull)
+
+		idle = waitForStatus(socketPath, lambda status: True, 10)
+		if not idle:
+			print('The popup server did not start')
+			sys.exit(1)
+		# Let the startup allocations settle
+		time.sleep(1)
+		idle = getStatus(socketPath)
+		results.append(('idle popup server', idle['rsskb']))
+
+		# The request stays open, the popup is shown until the server is stopped
+		request = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		request.connect(socketPath)
+		MessageChannel(None, request).send({'type': REQUEST_PRINT_JOB_PARAMETERS, 'trace': 'benchmark', 'job': 1, 'title': 'benchmark', 'copies': 1, 'size': 1024})
+		active = waitForStatus(socketPath, lambda status: status['dialogs'] > 0 or status['answered'] > 0, 30)
+		if active and active['dialogs'] > 0:
+			results.append(('popup server, popup shown', active['rsskb']))
+			results.append(('GUI process, popup shown', active['guirsskb']))
+			results.append(('total, popup shown', active['rsskb'] + active['guirsskb']))
+		else:
+			print('The GUI process did not show the popup, is DISPLAY set?')
+		request.close()
+
+		inProcess = measureInProcessWx()
+		if inProcess:
+			results.append(('process with wx loaded', inProcess))
+	finally:
+		if server and server.poll() is None:
+			server.terminate()
+			server.wait()
+		shutil.rmtree(workDIR)
+
+	for name, kilobytes in results:
+		print('%-30s %8d KB' %(name, kilobytes))
+
+	if options.max_idle_kb and results[0][1] > options.max_idle_kb:
+		print('The idle popup server exceeded the %d KB budget' %options.max_idle_kb)
+		sys.exit(1)
+
+if __name__ == "__main__":
+	main()
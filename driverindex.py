@@ -0,0 +1,219 @@
+#!/usr/bin/python2
+# Script Name: driverindex.py
+# Script Function:
+#	This script provides the index of the printer drivers installed on the system. One
+#	lpinfo -m call lists every driver, and the list is kept in a marshal file in the pharos
+#	cache directory together with the modification times of the PPD and driver directories.
+#	The next install run reuses the file when no driver was added or removed since, so the
+#	driver of every printer is looked up in memory instead of by an lpinfo call each
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'driverindex'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import re
+import marshal
+import subprocess
+from pharosconfig import openCache, canWriteCache
+
+# Script Variables ======================
+pharosCacheDIR = os.environ.get('PHAROS_CACHE_DIR', '/var/cache/pharos')
+driverIndexFileName = 'drivers.cache'
+cacheFormatVersion = 1
+
+# Directories cups-driverd reads PPD files and driver information files from
+driverDIRs = [
+	'/usr/share/ppd',
+	'/usr/local/share/ppd',
+	'/opt/share/ppd',
+	'/usr/share/cups/model',
+	'/usr/local/share/cups/model',
+	'/usr/share/cups/drv',
+	'/usr/local/share/cups/drv',
+	'/usr/lib/cups/driver',
+	'/usr/libexec/cups/driver',
+]
+
+# Function Declaration ==================
+def normaliseName(name):
+	"""
+	Returns the make and model or driver name in lower case with punctuation and repeated
+	white space removed, as used for the keys of the index
+	"""
+	return ' '.join(re.sub('[^0-9a-z+]+', ' ', name.lower()).split())
+
+def getDriverDIRsStamp(dirs=driverDIRs):
+	"""
+	Returns the modification times of the driver directories and all their subdirectories.
+	Installing or removing a driver package changes the time of the directory it writes to
+	"""
+	stamp = []
+	for top in dirs:
+		for dirPath, dirNames, fileNames in os.walk(top, followlinks=True):
+			try:
+				stamp.append((dirPath, int(os.stat(dirPath).st_mtime)))
+			except OSError:
+				pass
+	stamp.sort()
+	return stamp
+
+# Class definitions =====================
+class DriverIndex:
+	"""
+	The drivers lpinfo -m lists, indexed by normalised make and model. Lookups give the same
+	driver the lpinfo --make-and-model query they replace did
+	"""
+	def __init__(self, log, cacheDIR=pharosCacheDIR):
+		"""
+		Constructor
+		"""
+		self.logger = log
+		self.path = os.path.join(cacheDIR, driverIndexFileName)
+		# (driver name, make and model) in the order lpinfo listed them
+		self.drivers = []
+		self.byMakeAndModel = {}
+		self.byName = {}
+		self.lookups = {}
+
+	def load(self):
+		"""
+		Loads the index from the cache file, or lists the drivers with lpinfo when the cache
+		is missing or the driver directories changed since it was written
+		"""
+		stamp = getDriverDIRsStamp()
+		drivers = self.read(stamp)
+		if drivers is None:
+			drivers = self.listDrivers()
+			if drivers is None:
+				return self
+			self.save(stamp, drivers)
+		else:
+			self.logger.info('Using %d drivers from driver index %s' %(len(drivers), self.path))
+		self.setDrivers(drivers)
+		return self
+
+	def read(self, stamp):
+		"""
+		Returns the drivers in the cache file, None when it is missing, unreadable or stale
+		"""
+		cacheFile = openCache(self.path)
+		if not cacheFile:
+			return None
+		try:
+			try:
+				version, cacheStamp, drivers = marshal.load(cacheFile)
+			finally:
+				cacheFile.close()
+		except (IOError, EOFError, ValueError, TypeError):
+			return None
+		if version != cacheFormatVersion or cacheStamp != stamp:
+			self.logger.info('Driver directories changed since driver index %s was written' %self.path)
+			return None
+		return drivers
+
+	def save(self, stamp, drivers):
+		"""
+		Writes the drivers into the cache file. Failure to write is not an error
+		"""
+		tempPath = '%s.%d' %(self.path, os.getpid())
+		try:
+			if not os.path.exists(os.path.dirname(self.path)):
+				os.makedirs(os.path.dirname(self.path), 0755)
+			if not canWriteCache(os.path.dirname(self.path)):
+				self.logger.info('Not writing driver index %s, its directory belongs to another user' %self.path)
+				return
+			cacheFile = open(tempPath, 'wb')
+			try:
+				marshal.dump((cacheFormatVersion, stamp, drivers), cacheFile)
+			finally:
+				cacheFile.close()
+			os.chmod(tempPath, 0644)
+			os.rename(tempPath, self.path)
+			self.logger.info('Saved %d drivers in driver index %s' %(len(drivers), self.path))
+		except (IOError, OSError), e:
+			self.logger.warn('Could not write driver index %s: %s' %(self.path, e))
+			if os.path.exists(tempPath):
+				try:
+					os.remove(tempPath)
+				except OSError:
+					pass
+
+	def listDrivers(self):
+		"""
+		Returns the (driver name, make and model) of every installed driver, None when lpinfo fails
+		"""
+		self.logger.info('Listing installed drivers using lpinfo -m')
+		try:
+			lpinfo = subprocess.check_output(['lpinfo', '-m'])
+		except (subprocess.CalledProcessError, OSError), e:
+			self.logger.error('Could not list printer drivers using lpinfo: %s' %e)
+			return None
+		drivers = []
+		for line in lpinfo.split('\n'):
+			parts = line.strip().split(None, 1)
+			if len(parts) == 2:
+				drivers.append((parts[0], parts[1]))
+		self.logger.info('lpinfo listed %d drivers' %len(drivers))
+		return drivers
+
+	def setDrivers(self, drivers):
+		"""
+		Builds the indexes of the drivers
+		"""
+		self.drivers = [tuple(driver) for driver in drivers]
+		self.byMakeAndModel = {}
+		self.byName = {}
+		for driver in self.drivers:
+			self.byMakeAndModel.setdefault(normaliseName(driver[1]), []).append(driver)
+			self.byName.setdefault(driver[0], driver[1])
+		self.lookups = {}
+
+	def getModelDrivers(self, printerModel):
+		"""
+		Returns the drivers whose make and model matches the printer model, a case insensitive
+		regular expression as lpinfo --make-and-model takes
+		"""
+		try:
+			modelPattern = re.compile(printerModel, re.IGNORECASE)
+		except re.error:
+			modelPattern = re.compile(re.escape(printerModel), re.IGNORECASE)
+		return [driver for driver in self.drivers if modelPattern.search(driver[1])]
+
+	def findDriver(self, printerModel, printerDriver):
+		"""
+		Returns the name of the driver for the printer model whose make and model is
+		printerDriver or matches it as a regular expression, '' when none is installed
+		"""
+		key = (printerModel, printerDriver)
+		if key not in self.lookups:
+			driverName = ''
+			modelDrivers = self.getModelDrivers(printerModel)
+			self.logger.info('Total %d drivers found for <%s> make and model' %(len(modelDrivers), printerModel))
+			# A driver named exactly as configured wins over one that only contains the name
+			for driver in self.byMakeAndModel.get(normaliseName(printerDriver or ''), []):
+				if driver in modelDrivers:
+					driverName = driver[0]
+					break
+			if not driverName and printerDriver:
+				try:
+					driverPattern = re.compile(printerDriver)
+				except re.error:
+					driverPattern = re.compile(re.escape(printerDriver))
+				for driver in modelDrivers:
+					if driverPattern.search(driver[1]):
+						driverName = driver[0]
+						break
+			self.lookups[key] = driverName
+		return self.lookups[key]
+
+	def getMakeAndModel(self, driverName):
+		"""
+		Returns the make and model of the driver, as cupsd reports it for a queue using the
+		driver, None when the driver is not installed
+		"""
+		return self.byName.get(driverName)
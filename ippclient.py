@@ -0,0 +1,446 @@
+#!/usr/bin/python2
+# Script Name: ippclient.py
+# Script Function:
+#	This script provides a minimal IPP client that talks to the local cupsd over its domain
+#	socket (/run/cups/cups.sock), so the installer and uninstaller can add, modify, delete,
+#	enable and list print queues with one request each over a single kept-alive connection
+#	instead of forking lpadmin, lpoptions, cupsaccept and cupsenable. Requests are encoded as
+#	described in RFC 8010 and sent as HTTP/1.1 POSTs. Set CUPS_SERVER to a socket path to
+#	talk to another cupsd or a stand-in IPP server
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'ippclient'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import socket
+import struct
+
+# Script Variables ======================
+CUPS_SOCKET_PATHS = ['/run/cups/cups.sock', '/var/run/cups/cups.sock']
+# Certificates cupsd writes for local root authentication
+CUPS_ROOT_CERTIFICATES = ['/run/cups/certs/0', '/var/run/cups/certs/0']
+IPP_VERSION = (2, 0)
+
+# Operations
+IPP_OP_PAUSE_PRINTER = 0x0010
+IPP_OP_RESUME_PRINTER = 0x0011
+IPP_OP_GET_PRINTER_ATTRIBUTES = 0x000B
+IPP_OP_CUPS_GET_PRINTERS = 0x4002
+IPP_OP_CUPS_ADD_MODIFY_PRINTER = 0x4003
+IPP_OP_CUPS_DELETE_PRINTER = 0x4004
+IPP_OP_CUPS_ACCEPT_JOBS = 0x4008
+IPP_OP_CUPS_REJECT_JOBS = 0x4009
+
+# Attribute group tags
+IPP_TAG_OPERATION = 0x01
+IPP_TAG_JOB = 0x02
+IPP_TAG_END = 0x03
+IPP_TAG_PRINTER = 0x04
+IPP_TAG_UNSUPPORTED_GROUP = 0x05
+
+# Value tags
+IPP_TAG_INTEGER = 0x21
+IPP_TAG_BOOLEAN = 0x22
+IPP_TAG_ENUM = 0x23
+IPP_TAG_TEXT = 0x41
+IPP_TAG_NAME = 0x42
+IPP_TAG_KEYWORD = 0x44
+IPP_TAG_URI = 0x45
+IPP_TAG_CHARSET = 0x47
+IPP_TAG_LANGUAGE = 0x48
+IPP_TAG_MIMETYPE = 0x49
+IPP_TAG_TEXTLANG = 0x35
+IPP_TAG_NAMELANG = 0x36
+
+# Printer states
+IPP_PRINTER_IDLE = 3
+IPP_PRINTER_PROCESSING = 4
+IPP_PRINTER_STOPPED = 5
+
+# Status codes
+IPP_STATUS_OK = 0x0000
+IPP_STATUS_NOT_AUTHENTICATED = 0x0402
+IPP_STATUS_NOT_AUTHORIZED = 0x0403
+IPP_STATUS_NOT_FOUND = 0x0406
+
+# Error reasons reported by IPPError
+IPP_ERROR_CONNECT = 'connect'
+IPP_ERROR_IO = 'io'
+IPP_ERROR_HTTP = 'http'
+IPP_ERROR_AUTH = 'auth'
+IPP_ERROR_FORMAT = 'format'
+IPP_ERROR_STATUS = 'status'
+
+# Function Declaration ==================
+def getCupsSocketPath():
+	"""
+	Returns the cupsd domain socket to use, None when there is none
+	"""
+	server = os.environ.get('CUPS_SERVER', '')
+	if server.startswith('/'):
+		return server
+	for path in CUPS_SOCKET_PATHS:
+		if os.path.exists(path):
+			return path
+	return None
+
+def encodeAttribute(tag, name, values):
+	"""
+	Returns the encoding of an attribute with one or more values
+	"""
+	if not isinstance(values, (list, tuple)):
+		values = [values]
+	encoded = []
+	for index, value in enumerate(values):
+		if tag in (IPP_TAG_INTEGER, IPP_TAG_ENUM):
+			value = struct.pack('!i', value)
+		elif tag == IPP_TAG_BOOLEAN:
+			value = struct.pack('!B', value and 1 or 0)
+		elif isinstance(value, unicode):
+			value = value.encode('utf-8')
+		if index:
+			name = ''
+		encoded.append(struct.pack('!BH', tag, len(name)) + name + struct.pack('!H', len(value)) + value)
+	return ''.join(encoded)
+
+def decodeValue(tag, value):
+	"""
+	Returns the Python value of an encoded attribute value: int for integers and enums, bool
+	for booleans, str for strings and the raw bytes for anything else
+	"""
+	if tag in (IPP_TAG_INTEGER, IPP_TAG_ENUM) and len(value) == 4:
+		return struct.unpack('!i', value)[0]
+	if tag == IPP_TAG_BOOLEAN and len(value) == 1:
+		return value != '\0'
+	if tag in (IPP_TAG_TEXTLANG, IPP_TAG_NAMELANG) and len(value) >= 4:
+		# language length and language, then the text
+		languageLength = struct.unpack('!H', value[:2])[0]
+		textLength = struct.unpack('!H', value[2 + languageLength:4 + languageLength])[0]
+		return value[4 + languageLength:4 + languageLength + textLength]
+	return value
+
+def decodeResponse(data):
+	"""
+	Returns the (status code, groups) of an IPP response, where groups is a list of
+	(group tag, attributes) and attributes maps each name to a value or a list of values
+	"""
+	if len(data) < 8:
+		raise IPPError(IPP_ERROR_FORMAT, 'IPP response of %d bytes is too short' %len(data))
+	status = struct.unpack('!H', data[2:4])[0]
+	groups = []
+	attributes = None
+	name = None
+	offset = 8
+	try:
+		while offset < len(data):
+			tag = ord(data[offset])
+			offset += 1
+			if tag == IPP_TAG_END:
+				break
+			if tag < 0x10:
+				attributes = {}
+				groups.append((tag, attributes))
+				continue
+			nameLength = struct.unpack('!H', data[offset:offset + 2])[0]
+			offset += 2
+			attributeName = data[offset:offset + nameLength]
+			offset += nameLength
+			valueLength = struct.unpack('!H', data[offset:offset + 2])[0]
+			offset += 2
+			value = decodeValue(tag, data[offset:offset + valueLength])
+			offset += valueLength
+			if attributes is None:
+				raise IPPError(IPP_ERROR_FORMAT, 'IPP attribute outside of a group')
+			if attributeName:
+				name = attributeName
+				attributes[name] = value
+			elif name is not None:
+				# An additional value of the previous attribute
+				if not isinstance(attributes[name], list):
+					attributes[name] = [attributes[name]]
+				attributes[name].append(value)
+	except struct.error:
+		raise IPPError(IPP_ERROR_FORMAT, 'IPP response is truncated')
+	return status, groups
+
+# Class definitions =====================
+class IPPError(Exception):
+	"""
+	Raised when an IPP request fails. The reason is one of the IPP_ERROR_* values, status is
+	the IPP status code for IPP_ERROR_STATUS
+	"""
+	def __init__(self, reason, message, status=None):
+		Exception.__init__(self, message)
+		self.reason = reason
+		self.message = message
+		self.status = status
+
+class IPPClient:
+	"""
+	Sends IPP requests to cupsd over one kept-alive HTTP connection on its domain socket,
+	reconnecting when cupsd closes it
+	"""
+	def __init__(self, log, socketPath=None, timeout=30):
+		"""
+		Constructor
+		"""
+		self.logger = log
+		self.socketPath = socketPath or getCupsSocketPath()
+		self.timeout = timeout
+		self.s = None
+		self.buffer = ''
+		self.requestID = 0
+		self.authorization = None
+		import pwd
+		try:
+			self.userName = pwd.getpwuid(os.getuid()).pw_name
+		except KeyError:
+			self.userName = str(os.getuid())
+
+	def connect(self):
+		"""
+		Opens the connection to cupsd
+		"""
+		if not self.socketPath:
+			raise IPPError(IPP_ERROR_CONNECT, 'No cupsd domain socket found')
+		s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		s.settimeout(self.timeout)
+		try:
+			s.connect(self.socketPath)
+		except socket.error, e:
+			s.close()
+			raise IPPError(IPP_ERROR_CONNECT, 'Could not connect to cupsd at %s: %s' %(self.socketPath, e))
+		self.s = s
+		self.buffer = ''
+
+	def close(self):
+		"""
+		Closes the connection
+		"""
+		if self.s:
+			try:
+				self.s.close()
+			except socket.error:
+				pass
+			self.s = None
+
+	def getAuthorization(self):
+		"""
+		Returns the Authorization header value for administrative requests: the root
+		certificate of cupsd when it can be read, else the peer credentials of the socket
+		"""
+		for path in CUPS_ROOT_CERTIFICATES:
+			try:
+				certificate = open(path, 'r').read().strip()
+			except IOError:
+				continue
+			if certificate:
+				return 'Local %s' %certificate
+		return 'PeerCred %s' %self.userName
+
+	def readLine(self):
+		"""
+		Reads one CRLF terminated line of the HTTP response
+		"""
+		while '\r\n' not in self.buffer:
+			self.fill()
+		line, self.buffer = self.buffer.split('\r\n', 1)
+		return line
+
+	def readExactly(self, count):
+		"""
+		Reads count bytes of the HTTP response
+		"""
+		while len(self.buffer) < count:
+			self.fill()
+		data, self.buffer = self.buffer[:count], self.buffer[count:]
+		return data
+
+	def fill(self):
+		"""
+		Reads more of the HTTP response into the buffer
+		"""
+		try:
+			chunk = self.s.recv(65536)
+		except socket.timeout:
+			raise IPPError(IPP_ERROR_IO, 'Timed out waiting for cupsd')
+		except socket.error, e:
+			raise IPPError(IPP_ERROR_IO, 'Could not read from cupsd: %s' %e)
+		if not chunk:
+			raise IPPError(IPP_ERROR_IO, 'cupsd closed the connection')
+		self.buffer += chunk
+
+	def post(self, resource, body):
+		"""
+		Sends one HTTP POST and returns the (HTTP status, headers, body) of the response
+		"""
+		headers = ['POST %s HTTP/1.1' %resource, 'Host: localhost', 'Content-Type: application/ipp', 'Content-Length: %d' %len(body), 'User-Agent: pharos-ippclient/%s' %__version__]
+		if self.authorization:
+			headers.append('Authorization: %s' %self.authorization)
+		try:
+			self.s.sendall('\r\n'.join(headers) + '\r\n\r\n' + body)
+		except socket.error, e:
+			raise IPPError(IPP_ERROR_IO, 'Could not send to cupsd: %s' %e)
+		statusLine = self.readLine()
+		while statusLine.split(' ')[1:2] == ['100']:
+			# 100 Continue, the real response follows
+			while self.readLine():
+				pass
+			statusLine = self.readLine()
+		parts = statusLine.split(' ', 2)
+		if len(parts) < 2 or not parts[0].startswith('HTTP/') or not parts[1].isdigit():
+			raise IPPError(IPP_ERROR_HTTP, 'Unexpected HTTP status line %r' %statusLine)
+		responseHeaders = {}
+		line = self.readLine()
+		while line:
+			if ':' in line:
+				responseHeaders[line.split(':', 1)[0].strip().lower()] = line.split(':', 1)[1].strip()
+			line = self.readLine()
+		if responseHeaders.get('transfer-encoding', '').lower() == 'chunked':
+			chunks = []
+			size = int(self.readLine().split(';')[0], 16)
+			while size:
+				chunks.append(self.readExactly(size))
+				self.readLine()
+				size = int(self.readLine().split(';')[0], 16)
+			# Trailers end with an empty line
+			while self.readLine():
+				pass
+			responseBody = ''.join(chunks)
+		else:
+			responseBody = self.readExactly(int(responseHeaders.get('content-length', 0)))
+		if responseHeaders.get('connection', '').lower() == 'close':
+			self.close()
+		return int(parts[1]), responseHeaders, responseBody
+
+	def request(self, operation, operationAttributes=[], printerAttributes=[], resource='/', printerURI='ipp://localhost/'):
+		"""
+		Sends an IPP request and returns the groups of its response. Attributes are (value tag,
+		name, value or list of values) tuples. Raises IPPError when the request fails
+		"""
+		self.requestID += 1
+		body = [struct.pack('!BBHi', IPP_VERSION[0], IPP_VERSION[1], operation, self.requestID), chr(IPP_TAG_OPERATION)]
+		body.append(encodeAttribute(IPP_TAG_CHARSET, 'attributes-charset', 'utf-8'))
+		body.append(encodeAttribute(IPP_TAG_LANGUAGE, 'attributes-natural-language', 'en'))
+		body.append(encodeAttribute(IPP_TAG_URI, 'printer-uri', printerURI))
+		body.append(encodeAttribute(IPP_TAG_NAME, 'requesting-user-name', self.userName))
+		for tag, name, value in operationAttributes:
+			body.append(encodeAttribute(tag, name, value))
+		if printerAttributes:
+			body.append(chr(IPP_TAG_PRINTER))
+			for tag, name, value in printerAttributes:
+				body.append(encodeAttribute(tag, name, value))
+		body.append(chr(IPP_TAG_END))
+		body = ''.join(body)
+
+		for attempt in range(3):
+			if self.s is None:
+				self.connect()
+			try:
+				httpStatus, headers, responseBody = self.post(resource, body)
+			except IPPError, e:
+				# cupsd closes idle kept-alive connections, retry once on a new one
+				self.close()
+				if e.reason != IPP_ERROR_IO or attempt:
+					raise
+				continue
+			if httpStatus == 401 and not self.authorization:
+				self.authorization = self.getAuthorization()
+				continue
+			break
+		if httpStatus in (401, 403):
+			raise IPPError(IPP_ERROR_AUTH, 'cupsd refused the request (HTTP %d)' %httpStatus)
+		if httpStatus != 200:
+			raise IPPError(IPP_ERROR_HTTP, 'cupsd returned HTTP %d' %httpStatus)
+		status, groups = decodeResponse(responseBody)
+		if status in (IPP_STATUS_NOT_AUTHENTICATED, IPP_STATUS_NOT_AUTHORIZED):
+			raise IPPError(IPP_ERROR_AUTH, 'cupsd refused the request (IPP status 0x%04x)' %status, status)
+		if status >= 0x0100:
+			message = ''
+			for tag, attributes in groups:
+				if tag == IPP_TAG_OPERATION and 'status-message' in attributes:
+					message = ': %s' %attributes['status-message']
+			raise IPPError(IPP_ERROR_STATUS, 'IPP request 0x%04x failed with status 0x%04x%s' %(operation, status, message), status)
+		return groups
+
+	def getPrinterURI(self, printer):
+		"""
+		Returns the printer-uri of a local queue
+		"""
+		import urllib
+		return 'ipp://localhost/printers/%s' %urllib.quote(printer)
+
+	def getPrinters(self, attributes):
+		"""
+		Returns a dictionary of the requested attributes of every queue, keyed by queue name
+		"""
+		requested = list(attributes)
+		if 'printer-name' not in requested:
+			requested.append('printer-name')
+		groups = self.request(IPP_OP_CUPS_GET_PRINTERS, [(IPP_TAG_KEYWORD, 'requested-attributes', requested)])
+		printers = {}
+		for tag, printerAttributes in groups:
+			if tag == IPP_TAG_PRINTER and 'printer-name' in printerAttributes:
+				printers[printerAttributes['printer-name']] = printerAttributes
+		return printers
+
+	def getPrinterAttributes(self, printer, attributes=None):
+		"""
+		Returns the attributes of the queue, None when it does not exist
+		"""
+		operationAttributes = []
+		if attributes:
+			operationAttributes.append((IPP_TAG_KEYWORD, 'requested-attributes', list(attributes)))
+		try:
+			groups = self.request(IPP_OP_GET_PRINTER_ATTRIBUTES, operationAttributes, printerURI=self.getPrinterURI(printer))
+		except IPPError, e:
+			if e.status == IPP_STATUS_NOT_FOUND:
+				return None
+			raise
+		for tag, printerAttributes in groups:
+			if tag == IPP_TAG_PRINTER:
+				return printerAttributes
+		return {}
+
+	def addModifyPrinter(self, printer, deviceURI=None, ppdName=None, location=None, info=None, enable=False):
+		"""
+		Adds the queue or modifies an existing one, as lpadmin -p does. With enable the queue
+		accepts jobs and is started, as with lpadmin -E
+		"""
+		operationAttributes = []
+		printerAttributes = []
+		if ppdName:
+			operationAttributes.append((IPP_TAG_NAME, 'ppd-name', ppdName))
+		if deviceURI:
+			printerAttributes.append((IPP_TAG_URI, 'device-uri', deviceURI))
+		if location is not None:
+			printerAttributes.append((IPP_TAG_TEXT, 'printer-location', location))
+		if info is not None:
+			printerAttributes.append((IPP_TAG_TEXT, 'printer-info', info))
+		if enable:
+			printerAttributes.append((IPP_TAG_BOOLEAN, 'printer-is-accepting-jobs', True))
+			printerAttributes.append((IPP_TAG_ENUM, 'printer-state', IPP_PRINTER_IDLE))
+		self.request(IPP_OP_CUPS_ADD_MODIFY_PRINTER, operationAttributes, printerAttributes, resource='/admin/', printerURI=self.getPrinterURI(printer))
+
+	def deletePrinter(self, printer):
+		"""
+		Deletes the queue
+		"""
+		self.request(IPP_OP_CUPS_DELETE_PRINTER, resource='/admin/', printerURI=self.getPrinterURI(printer))
+
+	def acceptJobs(self, printer):
+		"""
+		Lets the queue accept jobs, as cupsaccept does
+		"""
+		self.request(IPP_OP_CUPS_ACCEPT_JOBS, resource='/admin/', printerURI=self.getPrinterURI(printer))
+
+	def resumePrinter(self, printer):
+		"""
+		Starts the queue, as cupsenable does
+		"""
+		self.request(IPP_OP_RESUME_PRINTER, resource='/admin/', printerURI=self.getPrinterURI(printer))
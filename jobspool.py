@@ -0,0 +1,236 @@
+#!/usr/bin/python2
+# Script Name: jobspool.py
+# Script Function:
+#	This script provides spooling of print data that the pharos backend receives on stdin.
+#	Small jobs are spooled into anonymous memory (memfd), larger ones into a file in the
+#	spool directory
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'jobspool'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import threading
+
+# Script Variables ======================
+MFD_CLOEXEC = 1
+
+# libc memfd_create, loaded on first use, False when it is not available
+memfdCreate = None
+
+# Function Declaration ==================
+def createMemoryFile(name):
+	"""
+	Returns the descriptor of a new anonymous memory file, or None when memfd_create is not available
+	"""
+	global memfdCreate
+	if memfdCreate is None:
+		memfdCreate = False
+		try:
+			import ctypes
+			libc = ctypes.CDLL('libc.so.6', use_errno=True)
+			memfdCreate = libc.memfd_create
+			memfdCreate.argtypes = [ctypes.c_char_p, ctypes.c_uint]
+			memfdCreate.restype = ctypes.c_int
+		except (ImportError, OSError, AttributeError):
+			pass
+	if not memfdCreate:
+		return None
+	fd = memfdCreate(name, MFD_CLOEXEC)
+	if fd < 0:
+		return None
+	return fd
+
+# Class definitions =====================
+class JobSpool:
+	"""
+	Copies print data from a file descriptor into a spool file using large block reads.
+	While the user is still answering the popup the data can be prefetched into memory
+	by a background thread, so nothing touches the disk if the job is cancelled.
+	Jobs of up to memoryThreshold bytes are spooled into an anonymous memory file, which
+	creates nothing in the filesystem, and move to a file in spoolDIR when they grow larger
+	"""
+	def __init__(self, log, blockSize=65536, spoolDIR=None, memoryThreshold=1048576):
+		"""
+		Constructor
+		"""
+		self.logger = log
+		self.blockSize = blockSize
+		self.spoolDIR = spoolDIR
+		self.memoryThreshold = memoryThreshold
+		self.path = None
+		self.inMemory = False
+		self.size = 0
+		self.blocks = []
+		self.buffered = 0
+		self.prefetched = 0
+		self.memoryLimit = 0
+		self.eof = False
+		self.error = None
+		self.stopping = False
+		self.discarded = False
+		self.condition = threading.Condition()
+		self.prefetchThread = None
+
+	def startPrefetch(self, sourceFD, memoryLimit):
+		"""
+		Starts reading sourceFD into memory in the background. Reading pauses once
+		memoryLimit bytes are buffered
+		"""
+		self.memoryLimit = memoryLimit
+		self.prefetchThread = threading.Thread(target=self.prefetch, args=(sourceFD,), name='prefetch')
+		self.prefetchThread.setDaemon(True)
+		self.prefetchThread.start()
+		self.logger.info('Started prefetching print data (memory limit %d bytes)' %memoryLimit)
+
+	def prefetch(self, sourceFD):
+		"""
+		Body of the prefetch thread. Errors are kept for stopPrefetch to raise
+		"""
+		try:
+			while True:
+				self.condition.acquire()
+				try:
+					while self.buffered >= self.memoryLimit and not self.stopping:
+						self.condition.wait()
+					if self.stopping:
+						return
+				finally:
+					self.condition.release()
+				block = os.read(sourceFD, self.blockSize)
+				self.condition.acquire()
+				try:
+					# A block read while the data was being discarded is dropped as well
+					if self.discarded:
+						return
+					if not block:
+						self.eof = True
+						return
+					self.blocks.append(block)
+					self.buffered += len(block)
+				finally:
+					self.condition.release()
+		except Exception, e:
+			# The backend may exit while this daemon thread is still blocked reading
+			self.error = e
+
+	def stopPrefetch(self):
+		"""
+		Stops the prefetch thread and keeps what it has read so far. Returns the prefetched blocks
+		"""
+		if self.prefetchThread:
+			self.condition.acquire()
+			self.stopping = True
+			self.condition.notify()
+			self.condition.release()
+			self.prefetchThread.join()
+			self.prefetchThread = None
+			self.prefetched = self.buffered
+			self.logger.info('Prefetched %d bytes while waiting for the user (end of input: %s)' %(self.buffered, self.eof))
+		if self.error:
+			raise self.error
+		return self.blocks
+
+	def discard(self):
+		"""
+		Drops all prefetched data without waiting for the prefetch thread, which drops what
+		it is still reading
+		"""
+		self.condition.acquire()
+		self.stopping = True
+		self.discarded = True
+		self.condition.notify()
+		self.blocks = []
+		self.buffered = 0
+		self.condition.release()
+		self.logger.info('Discarded prefetched print data')
+
+	def spoolFrom(self, sourceFD):
+		"""
+		Writes any prefetched data followed by the rest of sourceFD into a new spool file
+		and returns the open spool file, positioned at the start of the data
+		"""
+		blocks = self.stopPrefetch()
+		spoolFile = None
+		if self.buffered <= self.memoryThreshold:
+			spoolFile = self.openMemoryFile()
+		if spoolFile is None:
+			spoolFile = self.openDiskFile()
+		try:
+			for block in blocks:
+				spoolFile = self.write(spoolFile, block)
+			del blocks[:]
+			self.buffered = 0
+			while not self.eof:
+				block = os.read(sourceFD, self.blockSize)
+				if not block:
+					self.eof = True
+					break
+				spoolFile = self.write(spoolFile, block)
+			spoolFile.flush()
+			spoolFile.seek(0)
+		except (IOError, OSError):
+			spoolFile.close()
+			self.remove()
+			raise
+		self.logger.info('Spooled %d bytes to %s' %(self.size, self.path or 'memory'))
+		return spoolFile
+
+	def openMemoryFile(self):
+		"""
+		Returns a new anonymous memory spool file, or None when memory files are not available
+		"""
+		fd = createMemoryFile('pharos')
+		if fd is None:
+			return None
+		self.inMemory = True
+		self.logger.info('Spooling print data to memory')
+		return os.fdopen(fd, 'w+b')
+
+	def openDiskFile(self):
+		"""
+		Returns a new spool file in the spool directory
+		"""
+		import tempfile
+		fd, self.path = tempfile.mkstemp(prefix='pharos', dir=self.spoolDIR)
+		self.inMemory = False
+		self.logger.info('Spooling print data to %s' %self.path)
+		return os.fdopen(fd, 'w+b')
+
+	def write(self, spoolFile, block):
+		"""
+		Appends block to the spool file and returns the spool file, which is a new disk file
+		when a memory spool file outgrew the memory threshold
+		"""
+		if self.inMemory and self.size + len(block) > self.memoryThreshold:
+			diskFile = self.openDiskFile()
+			try:
+				spoolFile.flush()
+				spoolFile.seek(0)
+				while True:
+					data = spoolFile.read(self.blockSize)
+					if not data:
+						break
+					diskFile.write(data)
+			except (IOError, OSError):
+				diskFile.close()
+				raise
+			finally:
+				spoolFile.close()
+			spoolFile = diskFile
+		spoolFile.write(block)
+		self.size += len(block)
+		return spoolFile
+
+	def remove(self):
+		"""
+		Deletes the spool file if one was created
+		"""
+		if self.path and os.path.exists(self.path):
+			os.remove(self.path)
+			self.logger.info('Successfully removed spool file: %s' %self.path)
+		self.path = None
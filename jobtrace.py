@@ -0,0 +1,114 @@
+#!/usr/bin/python2
+# Script Name: jobtrace.py
+# Script Function:
+#	This script provides per job phase tracing for the pharos backend and popup server.
+#	Each phase of a job is timed with the monotonic clock and every job writes one compact
+#	JSON trace record under a correlation ID that the backend and the popup server share
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'jobtrace'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import time
+
+# Script Variables ======================
+CLOCK_MONOTONIC = 1
+# (clock_gettime from libc, timespec type, byref) once it has been looked up, False when it
+# is not available
+clockGettime = None
+
+# Function Declaration ==================
+def monotonicTime():
+	"""
+	Returns the CLOCK_MONOTONIC time in seconds. Falls back to the wall clock when
+	clock_gettime can not be called
+	"""
+	global clockGettime
+	if clockGettime is None:
+		clockGettime = False
+		try:
+			import ctypes
+			class timespec(ctypes.Structure):
+				_fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+			libc = ctypes.CDLL('libc.so.6', use_errno=True)
+			libc.clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+			clockGettime = (libc.clock_gettime, timespec, ctypes.byref)
+		except (ImportError, OSError, AttributeError):
+			pass
+	if clockGettime:
+		function, timespec, byref = clockGettime
+		# A timespec per call, the popup server calls this from several threads at once
+		value = timespec()
+		if function(CLOCK_MONOTONIC, byref(value)) == 0:
+			return value.tv_sec + value.tv_nsec / 1e9
+	return time.time()
+
+def newTraceID(jobID):
+	"""
+	Returns a new correlation ID for the given CUPS job ID
+	"""
+	return '%s-%s' %(jobID, os.urandom(4).encode('hex'))
+
+# Class definitions =====================
+class JobTrace:
+	"""
+	Collects the timings and byte counts of the phases of one job and writes them as one
+	JSON record to the trace logger when the job finishes
+	"""
+	def __init__(self, log, traceID, **fields):
+		"""
+		Constructor
+		"""
+		self.logger = log
+		self.traceID = traceID
+		self.fields = fields
+		self.started = monotonicTime()
+		self.startedAt = time.time()
+		self.phases = []
+		self.openPhases = {}
+		self.finished = False
+
+	def begin(self, phase):
+		"""
+		Marks the start of a phase
+		"""
+		self.openPhases[phase] = monotonicTime()
+
+	def end(self, phase, byteCount=None, **fields):
+		"""
+		Marks the end of a phase, recording the bytes it moved and any other fields
+		"""
+		if phase not in self.openPhases:
+			return
+		now = monotonicTime()
+		began = self.openPhases.pop(phase)
+		record = {'name': phase, 'at': round((began - self.started) * 1000.0, 3), 'ms': round((now - began) * 1000.0, 3)}
+		if byteCount is not None:
+			record['bytes'] = byteCount
+		record.update(fields)
+		self.phases.append(record)
+
+	def set(self, **fields):
+		"""
+		Adds fields to the trace record
+		"""
+		self.fields.update(fields)
+
+	def finish(self, status):
+		"""
+		Ends the phases still open, which were interrupted, and writes the trace record once
+		"""
+		if self.finished:
+			return
+		self.finished = True
+		for phase in sorted(self.openPhases.keys(), key=self.openPhases.get):
+			self.end(phase, interrupted=True)
+		import json
+		record = dict(self.fields)
+		record.update({'trace': self.traceID, 'time': round(self.startedAt, 3), 'status': status, 'ms': round((monotonicTime() - self.started) * 1000.0, 3), 'phases': self.phases})
+		self.logger.info(json.dumps(record, sort_keys=True, separators=(',', ':')))
@@ -0,0 +1,376 @@
+#!/usr/bin/python2
+# Script Name: lpdclient.py
+# Script Function:
+#	This script provides a streaming RFC 1179 LPD client used by the pharos backend
+#	to send print jobs straight to the Pharos LPD server
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'lpdclient'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import socket
+import errno
+import select
+import stat
+import string
+
+from jobtrace import monotonicTime
+
+# Script Variables ======================
+LPD_DEFAULT_PORT = 515
+LPD_RESERVED_PORTS = range(721, 732)
+SPLICE_F_MOVE = 1
+SPLICE_F_MORE = 4
+
+# libc sendfile/splice, loaded on first use
+kernelCopyFunctions = None
+
+# Error reasons reported by LPDError
+LPD_ERROR_LOOKUP = 'lookup'
+LPD_ERROR_CONNECT = 'connect'
+LPD_ERROR_TIMEOUT = 'timeout'
+LPD_ERROR_REFUSED = 'refused'
+LPD_ERROR_IO = 'io'
+LPD_ERROR_SOURCE = 'source'
+
+# How copies are sent: the data file once with a print line per copy in the control file,
+# or the data file once per copy for servers that print each data file only once
+LPD_COPIES_CONTROL = 'control'
+LPD_COPIES_RESEND = 'resend'
+LPD_COPY_MODES = (LPD_COPIES_CONTROL, LPD_COPIES_RESEND)
+# Data files of one job are named dfA to dfZ, then dfa to dfz
+LPD_DATA_FILE_LETTERS = string.ascii_uppercase + string.ascii_lowercase
+
+# Function Declaration ==================
+def getKernelCopyFunctions():
+	"""
+	Returns the libc (sendfile, splice) functions, or (None, None) when they are not available
+	"""
+	global kernelCopyFunctions
+	if kernelCopyFunctions is None:
+		kernelCopyFunctions = (None, None)
+		try:
+			import ctypes
+			libc = ctypes.CDLL('libc.so.6', use_errno=True)
+			sendfile = libc.sendfile
+			sendfile.argtypes = [ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t]
+			sendfile.restype = ctypes.c_ssize_t
+			splice = libc.splice
+			splice.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_uint]
+			splice.restype = ctypes.c_ssize_t
+			kernelCopyFunctions = (sendfile, splice)
+		except (ImportError, OSError, AttributeError):
+			pass
+	return kernelCopyFunctions
+
+def sanitiseControlValue(value, length):
+	"""
+	Returns the value without control characters, cut to length, so it can not end its
+	control file line early and add lines of its own
+	"""
+	return ''.join([c for c in value if c >= ' '])[:length]
+
+# Class definitions =====================
+class LPDError(Exception):
+	"""
+	Raised when the LPD conversation fails. The reason is one of the LPD_ERROR_* values
+	"""
+	def __init__(self, reason, message):
+		Exception.__init__(self, message)
+		self.reason = reason
+		self.message = message
+
+class LPDClient:
+	"""
+	Sends a single print job to an LPD queue as described in RFC 1179
+	"""
+	def __init__(self, log, server, queue, port=LPD_DEFAULT_PORT, connectTimeout=30, ioTimeout=300, sendBufferSize=0, blockSize=65536, reservedPort=False, copyMode=LPD_COPIES_CONTROL):
+		"""
+		Constructor
+		"""
+		self.logger = log
+		self.server = server
+		self.queue = queue
+		self.port = port
+		self.connectTimeout = connectTimeout
+		self.ioTimeout = ioTimeout
+		self.sendBufferSize = sendBufferSize
+		self.blockSize = blockSize
+		self.reservedPort = reservedPort
+		self.copyMode = copyMode
+		self.hostName = socket.gethostname().split('.')[0][:31]
+		self.s = None
+		# Seconds the name lookup and the successful connection took
+		self.resolveTime = None
+		self.connectTime = None
+
+	def connect(self):
+		"""
+		Opens the connection to the LPD server
+		"""
+		self.logger.info('Resolving LPD server %s port %d' %(self.server, self.port))
+		started = monotonicTime()
+		try:
+			addresses = socket.getaddrinfo(self.server, self.port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+		except socket.gaierror, (value, message):
+			raise LPDError(LPD_ERROR_LOOKUP, 'Could not resolve LPD server %s. Error %s' %(self.server, message))
+		resolved = monotonicTime()
+		self.resolveTime = resolved - started
+
+		lastError = 'no addresses returned'
+		for family, socktype, proto, canonname, address in addresses:
+			s = socket.socket(family, socktype, proto)
+			try:
+				if self.sendBufferSize > 0:
+					s.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sendBufferSize)
+				if self.reservedPort:
+					self.bindReservedPort(s, family)
+				s.settimeout(self.connectTimeout)
+				self.logger.info('Connecting to LPD server %s at %s' %(self.server, address[0]))
+				s.connect(address)
+			except socket.timeout:
+				s.close()
+				lastError = 'connection to %s timed out after %s seconds' %(address[0], self.connectTimeout)
+				continue
+			except socket.error, e:
+				s.close()
+				lastError = 'connection to %s failed: %s' %(address[0], e)
+				continue
+			self.connectTime = monotonicTime() - resolved
+			s.settimeout(self.ioTimeout)
+			s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			self.s = s
+			self.logger.info('Connected to LPD server %s' %self.server)
+			return
+
+		raise LPDError(LPD_ERROR_CONNECT, 'Could not connect to LPD server %s: %s' %(self.server, lastError))
+
+	def bindReservedPort(self, s, family):
+		"""
+		Binds the socket to one of the source ports 721-731 required by strict LPD servers
+		"""
+		for port in LPD_RESERVED_PORTS:
+			try:
+				if family == socket.AF_INET6:
+					s.bind(('::', port))
+				else:
+					s.bind(('0.0.0.0', port))
+				self.logger.info('Bound to reserved source port %d' %port)
+				return
+			except socket.error, e:
+				if e.errno == errno.EACCES:
+					self.logger.warn('Not permitted to bind reserved source ports, using any port')
+					return
+		self.logger.warn('All reserved source ports are in use, using any port')
+
+	def close(self):
+		"""
+		Closes the connection to the LPD server
+		"""
+		if self.s:
+			try:
+				self.s.close()
+			except socket.error:
+				pass
+			self.s = None
+
+	def sendCommand(self, command, description):
+		"""
+		Sends a command or subcommand line and waits for the acknowledgement byte
+		"""
+		try:
+			self.s.sendall(command)
+			ack = self.s.recv(1)
+		except socket.timeout:
+			raise LPDError(LPD_ERROR_TIMEOUT, 'Timed out waiting for LPD server to acknowledge %s' %description)
+		except socket.error, e:
+			raise LPDError(LPD_ERROR_IO, 'Connection error while sending %s: %s' %(description, e))
+		if ack != '\0':
+			raise LPDError(LPD_ERROR_REFUSED, 'LPD server did not accept %s (response %r)' %(description, ack))
+
+	def buildControlFile(self, jobNumber, userName, jobTitle, copies, dataFiles=1):
+		"""
+		Builds the control file contents for the job. Each of the dataFiles data files gets
+		copies print lines. Returns the data file names and the control file
+		"""
+		dataFileNames = ['df%s%03d%s' %(letter, jobNumber, self.hostName) for letter in LPD_DATA_FILE_LETTERS[:dataFiles]]
+		jobTitle = sanitiseControlValue(jobTitle, 99)
+		lines = ['H' + self.hostName, 'P' + sanitiseControlValue(userName, 31), 'J' + jobTitle, 'N' + jobTitle]
+		for dataFileName in dataFileNames:
+			for copy in range(max(copies, 1)):
+				lines.append('l' + dataFileName)
+		for dataFileName in dataFileNames:
+			lines.append('U' + dataFileName)
+		return dataFileNames, '\n'.join(lines) + '\n'
+
+	def sendBlock(self, block):
+		"""
+		Sends one block of print data
+		"""
+		try:
+			self.s.sendall(block)
+		except socket.timeout:
+			raise LPDError(LPD_ERROR_TIMEOUT, 'Timed out sending print data')
+		except socket.error, e:
+			raise LPDError(LPD_ERROR_IO, 'Connection error while sending print data: %s' %e)
+
+	def kernelCopy(self, function, sourceFD, count):
+		"""
+		Moves up to count bytes from sourceFD to the socket inside the kernel using sendfile or splice.
+		Returns the number of bytes moved (0 at end of input) or None if the call is not supported
+		"""
+		import ctypes
+		while True:
+			if function.__name__ == 'splice':
+				moved = function(sourceFD, None, self.s.fileno(), None, count, SPLICE_F_MOVE | SPLICE_F_MORE)
+			else:
+				moved = function(self.s.fileno(), sourceFD, None, count)
+			if moved >= 0:
+				return moved
+			error = ctypes.get_errno()
+			if error == errno.EAGAIN:
+				# socket buffer is full, wait until the server drains it
+				if not select.select([], [self.s], [], self.ioTimeout)[1]:
+					raise LPDError(LPD_ERROR_TIMEOUT, 'Timed out sending print data')
+			elif error == errno.EINTR:
+				continue
+			elif error in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):
+				return None
+			elif error in (errno.EPIPE, errno.ECONNRESET):
+				raise LPDError(LPD_ERROR_IO, 'Connection error while sending print data: %s' %os.strerror(error))
+			else:
+				raise LPDError(LPD_ERROR_SOURCE, 'Could not read print data: %s' %os.strerror(error))
+
+	def sendFileContents(self, source, size):
+		"""
+		Streams size bytes from the source file object to the server, using sendfile for
+		regular files and large block reads otherwise
+		"""
+		sourceFD = source.fileno()
+		remaining = size
+		sendfile = getKernelCopyFunctions()[0]
+		if sendfile is not None and stat.S_ISREG(os.fstat(sourceFD).st_mode):
+			while remaining > 0:
+				moved = self.kernelCopy(sendfile, sourceFD, remaining)
+				if moved is None:
+					self.logger.info('sendfile is not supported, falling back to block copy')
+					break
+				if moved == 0:
+					raise LPDError(LPD_ERROR_SOURCE, 'Print data ended %d bytes early' %remaining)
+				remaining -= moved
+		while remaining > 0:
+			try:
+				block = os.read(sourceFD, min(self.blockSize, remaining))
+			except OSError, e:
+				raise LPDError(LPD_ERROR_SOURCE, 'Could not read print data: %s' %e)
+			if not block:
+				raise LPDError(LPD_ERROR_SOURCE, 'Print data ended %d bytes early' %remaining)
+			self.sendBlock(block)
+			remaining -= len(block)
+
+	def streamContents(self, sourceFD):
+		"""
+		Streams everything up to end of input from sourceFD to the server, using splice when
+		the source is a pipe. Returns the number of bytes sent
+		"""
+		sent = 0
+		splice = getKernelCopyFunctions()[1]
+		if splice is not None and stat.S_ISFIFO(os.fstat(sourceFD).st_mode):
+			while True:
+				moved = self.kernelCopy(splice, sourceFD, self.blockSize * 16)
+				if moved is None:
+					self.logger.info('splice is not supported, falling back to block copy')
+					break
+				if moved == 0:
+					return sent
+				sent += moved
+		while True:
+			try:
+				block = os.read(sourceFD, self.blockSize)
+			except OSError, e:
+				raise LPDError(LPD_ERROR_SOURCE, 'Could not read print data: %s' %e)
+			if not block:
+				return sent
+			self.sendBlock(block)
+			sent += len(block)
+
+	def sendJobHeader(self, jobID, userName, jobTitle, copies, dataFiles=1):
+		"""
+		Starts the job on the queue and sends its control file. Returns the data file names
+		"""
+		jobNumber = int(jobID) % 1000
+		dataFileNames, controlFile = self.buildControlFile(jobNumber, userName, jobTitle, copies, dataFiles)
+		controlFileName = 'cfA%03d%s' %(jobNumber, self.hostName)
+
+		self.logger.info('Sending receive job command for queue %s' %self.queue)
+		self.sendCommand('\x02%s\n' %self.queue, 'receive job command for queue %s' %self.queue)
+
+		self.logger.info('Sending control file %s (%d bytes)' %(controlFileName, len(controlFile)))
+		self.sendCommand('\x02%d %s\n' %(len(controlFile), controlFileName), 'control file header')
+		self.sendCommand(controlFile + '\0', 'control file')
+		return dataFileNames
+
+	def printFile(self, jobID, userName, jobTitle, copies, source):
+		"""
+		Sends the job in source (an open file) to the queue. The data is sent once with the
+		copies in the control file, or once per copy in resend mode. Returns the number of bytes sent
+		"""
+		sourceFD = source.fileno()
+		start = os.lseek(sourceFD, 0, os.SEEK_CUR)
+		size = os.fstat(sourceFD).st_size - start
+		if size == 0:
+			# A data file length of 0 would announce a streamed job and the server would wait for data
+			self.logger.warn('Job %s has no print data, nothing was sent' %jobID)
+			return 0
+		copies = max(copies, 1)
+		if self.copyMode == LPD_COPIES_RESEND and copies > 1:
+			if copies > len(LPD_DATA_FILE_LETTERS):
+				self.logger.warn('A job holds at most %d data files, sending %d of %d copies' %(len(LPD_DATA_FILE_LETTERS), len(LPD_DATA_FILE_LETTERS), copies))
+			dataFileNames = self.sendJobHeader(jobID, userName, jobTitle, 1, min(copies, len(LPD_DATA_FILE_LETTERS)))
+		else:
+			dataFileNames = self.sendJobHeader(jobID, userName, jobTitle, copies)
+
+		sent = 0
+		for dataFileName in dataFileNames:
+			self.logger.info('Sending data file %s (%d bytes)' %(dataFileName, size))
+			os.lseek(sourceFD, start, os.SEEK_SET)
+			self.sendCommand('\x03%d %s\n' %(size, dataFileName), 'data file header')
+			self.sendFileContents(source, size)
+			self.sendCommand('\0', 'data file')
+			sent += size
+		self.logger.info('LPD server accepted job %s' %jobID)
+		return sent
+
+	def printStream(self, jobID, userName, jobTitle, copies, sourceFD, prefix=[]):
+		"""
+		Sends the job read from sourceFD, preceded by the already read blocks in prefix, without
+		knowing its size up front. The data file is announced with a length of 0 and ends when
+		the connection is closed, an extension to RFC 1179 that the server has to support.
+		A stream can only be sent once, so the copies always go in the control file.
+		Returns the number of bytes sent
+		"""
+		dataFileName = self.sendJobHeader(jobID, userName, jobTitle, copies)[0]
+
+		self.logger.info('Streaming data file %s' %dataFileName)
+		self.sendCommand('\x030 %s\n' %dataFileName, 'data file header')
+		sent = 0
+		for block in prefix:
+			self.sendBlock(block)
+			sent += len(block)
+		sent += self.streamContents(sourceFD)
+		try:
+			self.s.shutdown(socket.SHUT_WR)
+			ack = self.s.recv(1)
+		except socket.timeout:
+			raise LPDError(LPD_ERROR_TIMEOUT, 'Timed out waiting for LPD server to acknowledge data file')
+		except socket.error, e:
+			raise LPDError(LPD_ERROR_IO, 'Connection error while finishing print data: %s' %e)
+		if ack != '\0':
+			raise LPDError(LPD_ERROR_REFUSED, 'LPD server did not accept data file (response %r)' %ack)
+		self.logger.info('Streamed %d bytes for job %s' %(sent, jobID))
+		return sent
@@ -0,0 +1,164 @@
+#!/usr/bin/python2
+# Script Name: lpdhealth.py
+# Script Function:
+#	This script provides the health cache of the Pharos LPD servers. pharoshealthd records
+#	whether it could reach a server and how long the connection took, and the backend reads
+#	the cache to send the next job of a queue with several servers to the healthiest,
+#	fastest one first. The cache is a small marshal file in the root owned pharos cache
+#	directory that is atomically replaced, so reading it costs one open and no parsing.
+#	Processes not running as root only keep their records for the current job
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'lpdhealth'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import time
+import marshal
+from pharosconfig import openCache, canWriteCache
+
+# Script Variables ======================
+pharosCacheDIR = os.environ.get('PHAROS_CACHE_DIR', '/var/cache/pharos')
+healthCacheFileName = 'lpdhealth.cache'
+cacheFormatVersion = 1
+
+# Order in which servers are tried: reachable ones by connect time, then the ones without
+# a recent check in their configured order, then the ones that recently failed
+HEALTH_REACHABLE = 0
+HEALTH_UNKNOWN = 1
+HEALTH_UNREACHABLE = 2
+
+# Function Declaration ==================
+def splitServers(servers):
+	"""
+	Returns the list of servers in a comma separated server field, as in pharos://a,b/queue
+	"""
+	return [server.strip() for server in servers.split(',') if server.strip()]
+
+# Class definitions =====================
+class HealthCache:
+	"""
+	The last known state of each LPD server: reachable, connect time (rttms), name lookup
+	time (resolvems), error and the time it was checked
+	"""
+	def __init__(self, log, cacheDIR=pharosCacheDIR):
+		"""
+		Constructor
+		"""
+		self.logger = log
+		self.path = os.path.join(cacheDIR, healthCacheFileName)
+		self.servers = {}
+		self.updated = {}
+
+	def load(self):
+		"""
+		Loads the cache file. A missing or unreadable cache leaves it empty
+		"""
+		self.servers = self.read()
+		return self
+
+	def read(self):
+		"""
+		Returns the server records in the cache file
+		"""
+		cacheFile = openCache(self.path)
+		if not cacheFile:
+			return {}
+		try:
+			try:
+				version, servers = marshal.load(cacheFile)
+			finally:
+				cacheFile.close()
+		except (IOError, EOFError, ValueError, TypeError):
+			return {}
+		if version != cacheFormatVersion or not isinstance(servers, dict):
+			return {}
+		return servers
+
+	def get(self, server):
+		"""
+		Returns the record of the server or None
+		"""
+		return self.servers.get(server)
+
+	def record(self, server, reachable, rttms=None, resolvems=None, error=None, checker='backend'):
+		"""
+		Records the outcome of a connection to or probe of the server
+		"""
+		entry = {'reachable': reachable, 'rttms': rttms, 'resolvems': resolvems, 'error': error, 'checked': time.time(), 'checker': checker}
+		self.servers[server] = entry
+		self.updated[server] = entry
+
+	def save(self):
+		"""
+		Writes the records updated since loading into the cache file, keeping the newer record
+		of every server another process wrote in the meantime. Only the owner of the cache
+		directory (root) writes it. Failure to write is not an error
+		"""
+		if not self.updated or not canWriteCache(os.path.dirname(self.path)):
+			return
+		servers = self.read()
+		for server, entry in self.updated.items():
+			if server not in servers or servers[server].get('checked', 0) <= entry['checked']:
+				servers[server] = entry
+		tempPath = '%s.%d' %(self.path, os.getpid())
+		try:
+			cacheFile = open(tempPath, 'wb')
+			try:
+				marshal.dump((cacheFormatVersion, servers), cacheFile)
+			finally:
+				cacheFile.close()
+			os.chmod(tempPath, 0644)
+			os.rename(tempPath, self.path)
+			self.servers = servers
+			self.updated = {}
+		except (IOError, OSError), e:
+			self.logger.warn('Could not write LPD server health cache %s: %s' %(self.path, e))
+			if os.path.exists(tempPath):
+				try:
+					os.remove(tempPath)
+				except OSError:
+					pass
+
+	def getHealth(self, server, maxAge):
+		"""
+		Returns one of the HEALTH_* values for the server, HEALTH_UNKNOWN when its record is
+		older than maxAge seconds
+		"""
+		entry = self.servers.get(server)
+		if not entry or time.time() - entry.get('checked', 0) > maxAge:
+			return HEALTH_UNKNOWN
+		if entry.get('reachable'):
+			return HEALTH_REACHABLE
+		return HEALTH_UNREACHABLE
+
+	def describe(self, server, maxAge):
+		"""
+		Returns a short description of the server's health for the logs
+		"""
+		health = self.getHealth(server, maxAge)
+		entry = self.servers.get(server) or {}
+		if health == HEALTH_REACHABLE:
+			return '%s (reachable, %s ms)' %(server, entry.get('rttms'))
+		if health == HEALTH_UNREACHABLE:
+			return '%s (unreachable: %s)' %(server, entry.get('error'))
+		return '%s (unknown)' %server
+
+	def rankServers(self, servers, maxAge):
+		"""
+		Returns the servers in the order they should be tried. Every server is returned, a
+		server that recently failed is still tried when all the others fail
+		"""
+		ranked = []
+		for index, server in enumerate(servers):
+			health = self.getHealth(server, maxAge)
+			rtt = 0
+			if health == HEALTH_REACHABLE:
+				rtt = self.servers[server].get('rttms') or 0
+			ranked.append((health, rtt, index, server))
+		ranked.sort()
+		return [server for health, rtt, index, server in ranked]
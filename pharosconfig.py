@@ -0,0 +1,185 @@
+#!/usr/bin/python2
+# Script Name: pharosconfig.py
+# Script Function:
+#	This script provides fast loading of the pharos program configuration file.
+#	The parsed file is kept in a marshal cache that is rebuilt when the file changes,
+#	so short lived processes like the backend do not parse it on every start.
+#	Caches are only read when they are owned by root or the reading user and nobody else
+#	can write them or their directory, and only written by the owner of the directory
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'pharosconfig'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import stat
+import marshal
+
+# Script Variables ======================
+programConfigFilePath = os.environ.get('PHAROS_CONFIG_FILE', '/usr/local/etc/pharos.conf')
+pharosCacheDIR = os.environ.get('PHAROS_CACHE_DIR', '/var/cache/pharos')
+cacheFormatVersion = 1
+
+# Function Declaration ==================
+def isTrustedPath(st):
+	"""
+	Checks that a file or directory is owned by root or the current user and that no one
+	else can write to it
+	"""
+	return st.st_uid in (0, os.geteuid()) and not st.st_mode & (stat.S_IWGRP | stat.S_IWOTH)
+
+def openCache(path):
+	"""
+	Opens a cache file for reading. Returns None when it does not exist or could have been
+	written by another user, as the cached data is trusted
+	"""
+	try:
+		if not isTrustedPath(os.stat(os.path.dirname(os.path.abspath(path)))):
+			return None
+		fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+	except OSError:
+		return None
+	st = os.fstat(fd)
+	if not stat.S_ISREG(st.st_mode) or not isTrustedPath(st):
+		os.close(fd)
+		return None
+	return os.fdopen(fd, 'rb')
+
+def canWriteCache(cacheDIR):
+	"""
+	Checks if the current user owns the cache directory, only its owner writes caches
+	"""
+	try:
+		st = os.stat(cacheDIR)
+	except OSError:
+		return False
+	return st.st_uid == os.geteuid() and isTrustedPath(st)
+
+# Class definitions =====================
+class PharosConfig:
+	"""
+	Read only view of the program config file offering the ConfigParser methods used by the
+	pharos scripts. Values are returned raw, without % interpolation
+	"""
+	def __init__(self, path=programConfigFilePath, cacheDIR=pharosCacheDIR):
+		"""
+		Constructor
+		"""
+		self.path = path
+		self.cachePath = os.path.join(cacheDIR, os.path.basename(path) + '.cache')
+		self.sections = {}
+		self.loadedFromCache = False
+
+	def load(self):
+		"""
+		Loads the config file, using the cache when it matches the file's mtime and size.
+		A missing config file leaves the config empty
+		"""
+		try:
+			st = os.stat(self.path)
+		except OSError:
+			self.sections = {}
+			return self
+		stamp = (cacheFormatVersion, st.st_mtime, st.st_size)
+		cacheFile = openCache(self.cachePath)
+		if cacheFile:
+			try:
+				try:
+					cachedStamp, sections = marshal.load(cacheFile)
+				finally:
+					cacheFile.close()
+				if cachedStamp == stamp:
+					self.sections = sections
+					self.loadedFromCache = True
+					return self
+			except (IOError, EOFError, ValueError, TypeError):
+				pass
+		self.sections = self.parse()
+		self.writeCache(stamp)
+		return self
+
+	def parse(self):
+		"""
+		Parses the config file into a dictionary of section dictionaries
+		"""
+		import ConfigParser
+		config = ConfigParser.RawConfigParser()
+		config.read(self.path)
+		sections = {}
+		for section in config.sections():
+			sections[section] = dict(config.items(section))
+		return sections
+
+	def writeCache(self, stamp):
+		"""
+		Atomically replaces the cache file. Failure to write it is not an error
+		"""
+		if not canWriteCache(os.path.dirname(self.cachePath)):
+			return
+		tempPath = '%s.%d' %(self.cachePath, os.getpid())
+		try:
+			cacheFile = open(tempPath, 'wb')
+			try:
+				marshal.dump((stamp, self.sections), cacheFile)
+			finally:
+				cacheFile.close()
+			os.chmod(tempPath, 0644)
+			os.rename(tempPath, self.cachePath)
+		except (IOError, OSError):
+			if os.path.exists(tempPath):
+				try:
+					os.remove(tempPath)
+				except OSError:
+					pass
+
+	def has_section(self, section):
+		"""
+		Checks if the section exists
+		"""
+		return section in self.sections
+
+	def has_option(self, section, option):
+		"""
+		Checks if the option exists in the section
+		"""
+		return option.lower() in self.sections.get(section, {})
+
+	def items(self, section):
+		"""
+		Returns the (option, value) pairs of the section
+		"""
+		return self.sections[section].items()
+
+	def get(self, section, option):
+		"""
+		Returns the raw value of the option
+		"""
+		return self.sections[section][option.lower()]
+
+	def getint(self, section, option):
+		"""
+		Returns the value of the option as an integer
+		"""
+		return int(self.get(section, option))
+
+	def getfloat(self, section, option):
+		"""
+		Returns the value of the option as a float
+		"""
+		return float(self.get(section, option))
+
+	def getboolean(self, section, option):
+		"""
+		Returns the value of the option as a boolean. Raises ValueError for a value that is
+		neither true nor false, as ConfigParser does
+		"""
+		value = self.get(section, option).strip().lower()
+		if value in ('1', 'yes', 'true', 'on'):
+			return True
+		if value in ('0', 'no', 'false', 'off'):
+			return False
+		raise ValueError('Not a boolean: %s' %value)
@@ -0,0 +1,419 @@
+#!/usr/bin/python2
+# Script Name: pharoslogging.py
+# Script Function:
+#	This script provides the logging pipeline of the pharos backend and popup server.
+#	Every record goes into an in-memory ring buffer. Only records at the level of the
+#	configured handlers are written, by a background thread, to log files that many
+#	processes can share and rotate safely. The ring buffer, including the DEBUG records,
+#	is written out when something fails
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'pharoslogging'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import sys
+import stat
+import errno
+import time
+import logging
+import collections
+
+# Script Variables ======================
+# Handlers set up by configureLogging, kept for dumpRingBuffer and shutdownLogging
+ringBufferHandlers = []
+dispatchHandlers = []
+
+# Function Declaration ==================
+def prepareRecord(record):
+	"""
+	Formats the message and exception of a record so it can be kept or handed to another thread
+	"""
+	if record.args:
+		record.msg = record.getMessage()
+		record.args = None
+	if record.exc_info:
+		if not record.exc_text:
+			record.exc_text = logging.Formatter().formatException(record.exc_info)
+		record.exc_info = None
+	return record
+
+def openSharedFile(path, flags):
+	"""
+	Opens a file in the shared log directory without following symlinks, creating it
+	writable for every user like setup.py does. Only a file this process created is
+	chmoded, and a file that is not a regular file or has other hard links is refused
+	"""
+	for attempt in range(2):
+		try:
+			fd = os.open(path, flags | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0666)
+			os.fchmod(fd, 0666)
+			return fd
+		except OSError, e:
+			if e.errno != errno.EEXIST:
+				raise
+		try:
+			fd = os.open(path, flags | os.O_NOFOLLOW)
+		except OSError, e:
+			# Removed by a rotation in the meantime
+			if e.errno == errno.ENOENT:
+				continue
+			raise
+		st = os.fstat(fd)
+		if not stat.S_ISREG(st.st_mode) or st.st_nlink != 1:
+			os.close(fd)
+			raise OSError(errno.EPERM, 'Refusing to open %s, it is not a plain file' %path)
+		return fd
+	raise OSError(errno.ENOENT, 'Could not open %s' %path)
+
+def copySharedFile(source, target):
+	"""
+	Replaces the contents of target with those of source, both opened like openSharedFile does
+	"""
+	sourceFD = openSharedFile(source, os.O_RDONLY)
+	try:
+		targetFD = openSharedFile(target, os.O_WRONLY)
+		try:
+			os.ftruncate(targetFD, 0)
+			while True:
+				data = os.read(sourceFD, 65536)
+				if not data:
+					break
+				while data:
+					data = data[os.write(targetFD, data):]
+		finally:
+			os.close(targetFD)
+	finally:
+		os.close(sourceFD)
+
+# Class definitions =====================
+class DispatchHandler(logging.Handler):
+	"""
+	Hands records to the real handlers, on a background thread when asynchronous.
+	The thread is only started once the first record has to be written
+	"""
+	def __init__(self, handlers, asynchronous=True):
+		"""
+		Constructor
+		"""
+		logging.Handler.__init__(self)
+		self.handlers = handlers
+		self.asynchronous = asynchronous
+		self.queue = None
+		self.thread = None
+
+	def emit(self, record):
+		"""
+		Queues the record or writes it straight away
+		"""
+		if not self.asynchronous:
+			self.dispatch(record)
+			return
+		if self.thread is None:
+			import Queue
+			import threading
+			self.queue = Queue.Queue()
+			self.thread = threading.Thread(target=self.run, name='logging')
+			self.thread.setDaemon(True)
+			self.thread.start()
+		self.queue.put(prepareRecord(record))
+
+	def dispatch(self, record):
+		"""
+		Passes the record to every handler whose level it meets. Records dumped from the ring buffer go to every handler
+		"""
+		for handler in self.handlers:
+			if record.levelno >= handler.level or getattr(record, 'dumped', False):
+				handler.handle(record)
+
+	def run(self):
+		"""
+		Body of the logging thread
+		"""
+		while True:
+			record = self.queue.get()
+			if record is None:
+				break
+			self.dispatch(record)
+
+	def stop(self):
+		"""
+		Writes out the queued records and stops the logging thread
+		"""
+		if self.thread is not None:
+			self.queue.put(None)
+			self.thread.join()
+			self.thread = None
+		for handler in self.handlers:
+			handler.flush()
+
+class RingBufferHandler(logging.Handler):
+	"""
+	Keeps the last capacity records of any level in memory. Records at or above passLevel
+	go on to the target straight away, the rest only when the buffer is dumped. A record at
+	or above dumpLevel dumps the buffer
+	"""
+	def __init__(self, capacity, target, passLevel, dumpLevel=logging.ERROR):
+		"""
+		Constructor
+		"""
+		logging.Handler.__init__(self)
+		self.buffer = collections.deque(maxlen=capacity)
+		self.target = target
+		self.passLevel = passLevel
+		self.dumpLevel = dumpLevel
+
+	def emit(self, record):
+		"""
+		Buffers the record and passes it on when it is important enough
+		"""
+		prepareRecord(record)
+		if record.levelno >= self.dumpLevel:
+			self.dump('%s record logged' %record.levelname)
+		self.buffer.append(record)
+		if record.levelno >= self.passLevel:
+			self.target.handle(record)
+
+	def dump(self, reason):
+		"""
+		Writes out the buffered records that were not written yet
+		"""
+		held = [record for record in self.buffer if record.levelno < self.passLevel]
+		self.buffer.clear()
+		if not held:
+			return
+		self.target.handle(self.markerRecord(held[0], 'Begin debug ring buffer, %d records (%s)' %(len(held), reason)))
+		for record in held:
+			# Written whatever the handler levels are
+			record.dumped = True
+			self.target.handle(record)
+		self.target.handle(self.markerRecord(held[-1], 'End debug ring buffer'))
+
+	def markerRecord(self, record, message):
+		"""
+		Creates a record that marks the start or end of a dump
+		"""
+		return logging.makeLogRecord({'name': record.name, 'levelno': self.passLevel, 'levelname': logging.getLevelName(self.passLevel), 'msg': message, 'created': time.time(), 'process': os.getpid()})
+
+class SharedRotatingFileHandler(logging.FileHandler):
+	"""
+	Appends to a log file that many processes write at the same time. Every write holds an
+	flock on <file>.lock, reopens the file if it was removed or replaced, and rotates it
+	when it would grow beyond maxBytes or is older than maxAge seconds. 0 disables either limit
+	"""
+	def __init__(self, filename, maxBytes=0, backupCount=5, maxAge=0):
+		"""
+		Constructor
+		"""
+		self.maxBytes = maxBytes
+		self.backupCount = backupCount
+		self.maxAge = maxAge
+		self.lockPath = os.path.abspath(filename) + '.lock'
+		self.lockFD = None
+		logging.FileHandler.__init__(self, filename, 'a', delay=True)
+
+	def _open(self):
+		"""
+		Opens the log file, creating it writable for every user like setup.py does
+		"""
+		return os.fdopen(openSharedFile(self.baseFilename, os.O_WRONLY | os.O_APPEND), 'a')
+
+	def acquireFileLock(self):
+		"""
+		Takes the inter-process lock
+		"""
+		import fcntl
+		if self.lockFD is None:
+			self.lockFD = openSharedFile(self.lockPath, os.O_RDONLY)
+		fcntl.flock(self.lockFD, fcntl.LOCK_EX)
+
+	def releaseFileLock(self):
+		"""
+		Releases the inter-process lock
+		"""
+		import fcntl
+		fcntl.flock(self.lockFD, fcntl.LOCK_UN)
+
+	def emit(self, record):
+		"""
+		Writes the record under the lock
+		"""
+		try:
+			message = self.format(record) + '\n'
+			if isinstance(message, unicode):
+				message = message.encode('utf-8')
+			self.acquireFileLock()
+			try:
+				if self.stream is not None:
+					try:
+						if os.stat(self.baseFilename).st_ino != os.fstat(self.stream.fileno()).st_ino:
+							self.stream.close()
+							self.stream = None
+					except OSError:
+						self.stream.close()
+						self.stream = None
+				if self.shouldRotate(len(message)):
+					self.rotate()
+				if self.stream is None:
+					self.stream = self._open()
+				self.stream.write(message)
+				self.stream.flush()
+			finally:
+				self.releaseFileLock()
+		except (KeyboardInterrupt, SystemExit):
+			raise
+		except:
+			self.handleError(record)
+
+	def shouldRotate(self, length):
+		"""
+		Checks the size and age limits. Must be called with the lock held
+		"""
+		try:
+			size = os.stat(self.baseFilename).st_size
+		except OSError:
+			return False
+		if self.maxBytes > 0 and size > 0 and size + length > self.maxBytes:
+			return True
+		if self.maxAge > 0 and time.time() - os.fstat(self.lockFD).st_mtime >= self.maxAge:
+			return size > 0
+		return False
+
+	def rotate(self):
+		"""
+		Copies <file>.N to <file>.N+1 and the current file to <file>.1, then truncates the
+		current file. Must be called with the lock held. The log directory is sticky, so only
+		the owner of a file could rename it; copying lets every process sharing the file rotate it
+		"""
+		if self.stream is not None:
+			self.stream.close()
+			self.stream = None
+		for index in range(self.backupCount - 1, 0, -1):
+			source = '%s.%d' %(self.baseFilename, index)
+			if os.path.exists(source):
+				copySharedFile(source, '%s.%d' %(self.baseFilename, index + 1))
+		if self.backupCount > 0:
+			copySharedFile(self.baseFilename, self.baseFilename + '.1')
+		fd = openSharedFile(self.baseFilename, os.O_WRONLY)
+		try:
+			os.ftruncate(fd, 0)
+		finally:
+			os.close(fd)
+		if not os.path.islink(self.lockPath):
+			os.utime(self.lockPath, None)
+
+	def close(self):
+		"""
+		Closes the log and lock files
+		"""
+		logging.FileHandler.close(self)
+		if self.lockFD is not None:
+			os.close(self.lockFD)
+			self.lockFD = None
+
+# Function Declaration ==================
+def configureLogging(config, loggerName):
+	"""
+	Sets up the logger with the given qualname from the [loggers], [handlers] and [formatters]
+	sections of the config, like logging.config.fileConfig but without importing logging.config
+	and opening only the handlers this logger and the root logger use. The handlers are put
+	behind a ring buffer and, when [logging] async is on, a background writer thread.
+	Returns the named logger
+	"""
+	namespace = dict(vars(logging))
+	namespace['SharedRotatingFileHandler'] = SharedRotatingFileHandler
+	namespace['sys'] = sys
+
+	loggerSections = {}
+	for key in config.get('loggers', 'keys').split(','):
+		section = 'logger_' + key.strip()
+		if key.strip() == 'root':
+			loggerSections[''] = section
+		elif config.has_section(section):
+			loggerSections[config.get(section, 'qualname')] = section
+
+	# The named logger's handlers, plus the root logger's when it propagates
+	section = loggerSections[loggerName]
+	handlerKeys = []
+	if config.has_option(section, 'handlers'):
+		handlerKeys = [k.strip() for k in config.get(section, 'handlers').split(',') if k.strip()]
+	if (not config.has_option(section, 'propagate') or config.getint(section, 'propagate')) and '' in loggerSections:
+		if config.has_option(loggerSections[''], 'handlers'):
+			for key in config.get(loggerSections[''], 'handlers').split(','):
+				if key.strip() and key.strip() not in handlerKeys:
+					handlerKeys.append(key.strip())
+	formatters = {}
+	handlers = [createHandler(config, key, namespace, formatters) for key in handlerKeys]
+
+	asynchronous = True
+	capacity = 1000
+	dumpLevel = logging.ERROR
+	if config.has_option('logging', 'async'):
+		asynchronous = config.getboolean('logging', 'async')
+	if config.has_option('logging', 'ringbuffer'):
+		capacity = config.getint('logging', 'ringbuffer')
+	if config.has_option('logging', 'dumplevel'):
+		dumpLevel = logging.getLevelName(config.get('logging', 'dumplevel'))
+
+	dispatcher = DispatchHandler(handlers, asynchronous)
+	passLevel = min([handler.level for handler in handlers] or [logging.CRITICAL])
+	ring = RingBufferHandler(capacity, dispatcher, passLevel, dumpLevel)
+	dispatchHandlers.append(dispatcher)
+	ringBufferHandlers.append(ring)
+
+	logger = logging.getLogger(loggerName)
+	for handler in logger.handlers[:]:
+		logger.removeHandler(handler)
+	logger.addHandler(ring)
+	logger.setLevel(logging.DEBUG)
+	logger.propagate = False
+	if len(dispatchHandlers) == 1:
+		import atexit
+		atexit.register(shutdownLogging)
+	return logger
+
+def createHandler(config, key, namespace, formatters):
+	"""
+	Creates the handler defined in the [handler_<key>] section
+	"""
+	section = 'handler_' + key
+	className = config.get(section, 'class')
+	if className.startswith('handlers.'):
+		from logging import handlers
+		namespace['handlers'] = handlers
+	handlerClass = eval(className, namespace)
+	args = eval(config.get(section, 'args'), namespace)
+	handler = handlerClass(*args)
+	if config.has_option(section, 'level'):
+		handler.setLevel(logging.getLevelName(config.get(section, 'level')))
+	if config.has_option(section, 'formatter') and config.get(section, 'formatter'):
+		formatterKey = config.get(section, 'formatter')
+		if formatterKey not in formatters:
+			formatSection = 'formatter_' + formatterKey
+			fmt = None
+			datefmt = None
+			if config.has_option(formatSection, 'format'):
+				fmt = config.get(formatSection, 'format')
+			if config.has_option(formatSection, 'datefmt'):
+				datefmt = config.get(formatSection, 'datefmt')
+			formatters[formatterKey] = logging.Formatter(fmt, datefmt)
+		handler.setFormatter(formatters[formatterKey])
+	return handler
+
+def dumpRingBuffer(reason):
+	"""
+	Writes out the buffered records of every configured logger, e.g. when a job fails
+	"""
+	for ring in ringBufferHandlers:
+		ring.dump(reason)
+
+def shutdownLogging():
+	"""
+	Writes out everything still queued and stops the logging threads
+	"""
+	for dispatcher in dispatchHandlers:
+		dispatcher.stop()
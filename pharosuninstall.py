@@ -4,7 +4,8 @@
 #	This script will uninstall pharos remote printing from the system.
 #	The following tasks will be performed:
 #	1. Remove the pharos backend from cups backend directory
-#	2. Remove the popup scripts from /usr/local/bin/pharospopup
+#	2. Remove the popup scripts from /usr/local/bin/pharospopup, the popup broker service and
+#	   the LPD server health daemon service
 #	3. Remove the config file from /usr/local/etc/
 #	4. Remove the uninstall script from /usr/local/bin/
 #	5. Remove the users desktop environment autorun settings for running pharospoup at login
@@ -30,12 +31,18 @@ import ConfigParser
 logFile = '/tmp/pharosuninstall.log'
 pharosBackendFileName = 'pharos'
 pharosPopupServerFileName = 'pharospopup'
+pharosBrokerFileName = 'pharosbroker'
+pharosBrokerServiceName = 'pharosbroker.service'
+pharosHealthDaemonFileName = 'pharoshealthd'
+pharosHealthDaemonServiceName = 'pharoshealthd.service'
 pharosConfigFileName = 'pharos.conf'
 
 popupServerInstallDIR = '/usr/local/bin'
 pharosConfigInstallDIR = '/usr/local/etc'
+systemdUnitDIR = '/etc/systemd/system'
 pharosLogDIR = '/var/log/pharos'
-programLogFiles = ['pharos.log', 'pharospopup.log']
+pharosCacheDIR = '/var/cache/pharos'
+programLogFiles = ['pharos.log', 'pharospopup.log', 'pharosbroker.log', 'pharoshealthd.log', 'pharos-trace.log']
 
 # Functions =============================
 class PharosUninstaller:
@@ -52,19 +59,8 @@ class PharosUninstaller:
 		Uninstall Pharos Printers
 		"""
 		self.logger.info('Uninstalling all pharos printers')
-		allLocalPrinters = self.printerUtility.getAllPrinters()
-		pharosPrinter = []
-		for printer in allLocalPrinters.keys():
-			printerSettings = allLocalPrinters[printer]
-			if printerSettings.has_key('device-uri'):
-				self.logger.info('Checking if printer %s with device uri %s is a pharos printer' %(printer, printerSettings['device-uri']))
-				if re.match('pharos:\/\/', printerSettings['device-uri']):
-					self.logger.info('Printer %s is a pharos printer' %printer)
-					pharosPrinter.append(printer)
-				else:
-					self.logger.info('Printer %s is not a pharos printer' %printer)				
-			else:
-				self.logger.warn('could not find device-uri in printer settings %s' %printerSettings)
+		pharosPrinter = self.printerUtility.getPrinterSnapshot().printersWithScheme('pharos')
+		self.logger.info('Pharos printers = %s' %pharosPrinter)
 		
 		allPharosPrintersDeleted = True
 		if len(pharosPrinter) > 0:
@@ -154,6 +150,45 @@ class PharosUninstaller:
 							
 		return removedAllFiles
 		
+	def uninstallDaemon(self, name, initScript, binary):
+		"""
+		Stops the daemon's systemd service, or kills it where it runs without one, and removes
+		its service file and executable
+		"""
+		self.logger.info('Uninstall %s' %name)
+		serviceFile = os.path.join(systemdUnitDIR, initScript)
+		if os.path.exists(serviceFile):
+			self.logger.info('Stopping service %s' %initScript)
+			try:
+				subprocess.check_output(['systemctl', 'disable', '--now', initScript])
+			except (OSError, subprocess.CalledProcessError) as e:
+				self.logger.warn('Could not stop %s. Error: %s' %(initScript, e))
+		elif self.processUtility.isProcessRunning(binary):
+			self.processUtility.killProcess(binary)
+
+		removedAllFiles = True
+		for daemonFile in [serviceFile, os.path.join(popupServerInstallDIR, binary)]:
+			if os.path.exists(daemonFile):
+				try:
+					os.unlink(daemonFile)
+					self.logger.info('Successfully removed %s' %daemonFile)
+				except OSError:
+					self.logger.error('Could not remove %s' %daemonFile)
+					removedAllFiles = False
+		return removedAllFiles
+
+	def uninstallBroker(self):
+		"""
+		Stops the popup broker service and removes its files
+		"""
+		return self.uninstallDaemon('popup broker', pharosBrokerServiceName, pharosBrokerFileName)
+
+	def uninstallHealthDaemon(self):
+		"""
+		Stops the LPD server health daemon service and removes its files
+		"""
+		return self.uninstallDaemon('LPD server health daemon', pharosHealthDaemonServiceName, pharosHealthDaemonFileName)
+
 	def removePopupServerFromGnomeSession(self):
 		"""
 		Removes the popup server from GNOME session manager
@@ -295,6 +330,23 @@ class PharosUninstaller:
 		
 		return True		
 
+	def uninstallCacheFiles(self):
+		"""
+		Remove cache files used
+		"""
+		self.logger.info('Uninstall Cache Files')
+		self.logger.info('Checking if cache directory exists at %s' %pharosCacheDIR)
+		if os.path.exists(pharosCacheDIR):
+			self.logger.info('Cache directory exists. Trying to remove it')
+			try:
+				shutil.rmtree(pharosCacheDIR)
+				self.logger.info('Successfully removed directory %s' %pharosCacheDIR)
+			except:
+				self.logger.error('Could not remove directory %s' %pharosCacheDIR)
+				return False
+		
+		return True
+
 	def uninstall(self):
 		""""
 		The main function
@@ -319,6 +371,20 @@ class PharosUninstaller:
 			self.logger.error('Could not remove pharos popup file')
 			returnCode = False
 		
+		print('Uninstalling popup broker')
+		if self.uninstallBroker():
+			self.logger.info('Successfully removed popup broker')
+		else:
+			self.logger.error('Could not remove popup broker')
+			returnCode = False
+
+		print('Uninstalling LPD server health daemon')
+		if self.uninstallHealthDaemon():
+			self.logger.info('Successfully removed LPD server health daemon')
+		else:
+			self.logger.error('Could not remove LPD server health daemon')
+			returnCode = False
+		
 		print('Uninstalling autostart entries from GUI session manager')
 		if self.uninstallStartupEntries():
 			self.logger.info('Successfully removed startup entries for pharos popup')
@@ -332,4 +398,11 @@ class PharosUninstaller:
 		else:
 			self.logger.error('Could not remove startup pharos log files')
 			returnCode = False
+		
+		print('Uninstalling cache files')
+		if self.uninstallCacheFiles():
+			self.logger.info('Successfully removed pharos cache files')
+		else:
+			self.logger.error('Could not remove pharos cache files')
+			returnCode = False
 		return returnCode
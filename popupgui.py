@@ -0,0 +1,200 @@
+#!/usr/bin/python2
+# Script Name: popupgui.py
+# Script Function:
+#	This script provides the wx popup of the pharos popup server. It runs in a child process
+#	that the popup server starts on the first popup and stops again once it has been idle,
+#	so the popup server itself never loads wx. The two processes exchange popupprotocol
+#	messages over a socket pair passed as the child's standard input
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'popupgui'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import logging
+import threading
+import wx
+
+from popupprotocol import getJobLabel, MessageChannel, ProtocolError, GUI_ASK, GUI_SHOWN, GUI_ANSWER
+
+# Script Variables ======================
+logger = logging.getLogger('pharospopup')
+
+# Class definitions =====================
+class wxPopupFrame(wx.Frame):
+	"""This is the frame for our application, it is derived from
+	the wx.Frame element. It is laid out once and hidden between popups"""
+
+	def __init__(self, *args, **kwargs):
+		"""Initialize, and let the user set any Frame settings"""
+		wx.Frame.__init__(self, *args, **kwargs)
+		self.jobs = []
+		self.onAnswer = None
+		self.create_controls()                         
+
+	def create_controls(self):
+		"""Called when the controls on Window are to be created"""
+		titleFont = wx.Font(14, wx.DEFAULT, wx.NORMAL, wx.BOLD)		
+		self.titleText = wx.StaticText(self, -1, "Print Job Details")
+		self.titleText.SetFont(titleFont)
+		# A burst of jobs is listed so that the user can pick the ones to print
+		self.jobsText = wx.StaticText(self, -1, "")
+		self.jobsCheckList = wx.CheckListBox(self, -1, choices=[])
+		self.userInputText = wx.StaticText(self, -1, "Please enter your myIIT ID*")
+		self.sizingPanelAfterUserInputText = wx.Panel(self, -1)
+		self.userInputTextCtrl = wx.TextCtrl(self, -1, "",  style=wx.TE_PROCESS_ENTER)
+		self.userInformationText = wx.StaticText(self, -1, "* This ID will be used at the release station to release your print job")
+		self.sizingPanelBeforeButtons = wx.Panel(self, -1)
+		self.printButton = wx.Button(self, -1, "Print")
+		self.cancelButton = wx.Button(self, -1, "Cancel")
+
+		self.__set_properties()
+		self.__do_layout()
+
+		self.Bind(wx.EVT_BUTTON, self.printCommand, self.printButton)
+		self.Bind(wx.EVT_BUTTON, self.cancelCommand, self.cancelButton)
+		self.Bind(wx.EVT_CLOSE,  self.cancelCommand) 
+		self.Bind(wx.EVT_TEXT_ENTER,  self.printCommand,  self.userInputTextCtrl)
+
+	def __set_properties(self):
+		"""Set the display properties of the frame"""
+		self.SetTitle("Remote Printing Popup")
+		self.SetSize((520, 250))
+
+	def __do_layout(self):
+		"""Perform the layout of items onto the frame"""
+		PopupFrameSizer = wx.BoxSizer(wx.VERTICAL)
+		buttonsBoxSizer = wx.BoxSizer(wx.HORIZONTAL)
+		userInputBoxSizer = wx.BoxSizer(wx.HORIZONTAL)
+		PopupFrameSizer.Add(self.titleText, 0, wx.EXPAND|wx.ALL|wx.ALIGN_CENTER_VERTICAL, 2)
+		PopupFrameSizer.Add(self.jobsText, 0, wx.ALL, 2)
+		PopupFrameSizer.Add(self.jobsCheckList, 3, wx.EXPAND|wx.ALL, 2)
+		userInputBoxSizer.Add(self.userInputText, 0, wx.ALL|wx.ALIGN_CENTER_VERTICAL, 0)
+		userInputBoxSizer.Add(self.sizingPanelAfterUserInputText, 1, wx.EXPAND, 0)
+		userInputBoxSizer.Add(self.userInputTextCtrl, 10, wx.ALL|wx.ALIGN_CENTER_VERTICAL, 0)
+		PopupFrameSizer.Add(userInputBoxSizer, 1, wx.EXPAND, 0)
+		PopupFrameSizer.Add(self.userInformationText, 0, 0, 0)
+		buttonsBoxSizer.Add(self.sizingPanelBeforeButtons, 1, wx.EXPAND, 0)
+		buttonsBoxSizer.Add(self.printButton, 0, wx.ALIGN_CENTER_VERTICAL, 0)
+		buttonsBoxSizer.Add(self.cancelButton, 0, wx.ALIGN_CENTER_VERTICAL, 0)
+		PopupFrameSizer.Add(buttonsBoxSizer, 1, wx.EXPAND, 0)
+		self.SetSizer(PopupFrameSizer)
+		self.Layout()
+		self.Centre()           
+
+	def ask(self, jobs, cachedID, onAnswer):
+		"""Reset the frame for the given print jobs and show it. onAnswer is called with
+		the users answer when they print or cancel"""
+		self.jobs = jobs
+		self.onAnswer = onAnswer
+		listJobs = len(jobs) > 1
+		if listJobs:
+			self.jobsText.SetLabel("Select the %d print jobs to release" %len(jobs))
+			self.jobsCheckList.Set([getJobLabel(job) for job in jobs])
+			for index in range(len(jobs)):
+				self.jobsCheckList.Check(index)
+			self.SetSize((520, 250 + 20 * min(len(jobs), 10)))
+		else:
+			self.SetSize((520, 250))
+		self.jobsText.Show(listJobs)
+		self.jobsCheckList.Show(listJobs)
+		self.userInputTextCtrl.SetValue(cachedID or "")
+		self.Layout()
+		self.Centre()
+		self.Show()
+		self.Raise()
+		self.userInputTextCtrl.SetFocus()
+
+	def answer(self, result):
+		"""Hide the frame and hand the users answer to the popup server"""
+		self.Hide()
+		onAnswer, self.onAnswer = self.onAnswer, None
+		if onAnswer:
+			onAnswer(result)
+
+	def printCommand(self, event):
+		"""Handle the users choice of clicking the print button"""
+		inputLength = len(self.userInputTextCtrl.GetValue().strip())
+		listJobs = len(self.jobs) > 1
+		if self.userInputTextCtrl.IsEmpty() or inputLength == 0:
+			logger.warn('User entered invalid input. Displaying warning message')
+			errorDialog = wx.MessageDialog(self, "User ID cannot be blank", "Input Error",  wx.OK | wx.ICON_ERROR)
+			errorDialog.ShowModal()
+			self.userInputTextCtrl.Clear()
+		elif listJobs and not self.jobsCheckList.GetChecked():
+			logger.warn('User selected no print job. Displaying warning message')
+			errorDialog = wx.MessageDialog(self, "Select at least one print job", "Input Error",  wx.OK | wx.ICON_ERROR)
+			errorDialog.ShowModal()
+		else:                
+			logger.info("User entered %s" %(self.userInputTextCtrl.GetValue().strip()))
+			selected = [True] * len(self.jobs)
+			if listJobs:
+				selected = [self.jobsCheckList.IsChecked(index) for index in range(len(self.jobs))]
+			self.answer({'userid': self.userInputTextCtrl.GetValue().strip(), 'printjob': True, 'selected': selected})
+			event.Skip()
+
+	def cancelCommand(self, event):
+		"""Handle the users choice of clicking the cancel button or closing the window"""
+		logger.warn('User chose to cancel the print job')
+		self.answer({'userid': None, 'printjob': False, 'selected': [False] * len(self.jobs)})
+
+class wxRemotePrintingPopupApp(wx.App):
+	"""The wx.App for the wxRemotePrintingPopup application. It runs for as long as the
+	popup server and keeps the hidden popup frame ready"""
+	def OnInit(self):
+		"""Override OnInit to create our Frame"""            
+		self.frame = wxPopupFrame(None, title="Remote Printing")            
+		self.SetTopWindow(self.frame)            
+		# The main loop keeps running while the frame is hidden
+		self.SetExitOnFrameDelete(False)
+		return True
+
+# Function Declaration ==================
+def runGUI(log, sock):
+	"""
+	Shows the popups the popup server asks for over sock until it closes the connection.
+	Returns the exit status of the GUI process
+	"""
+	channel = MessageChannel(log, sock)
+	app = wxRemotePrintingPopupApp(False)
+
+	def answer(request, result):
+		try:
+			channel.send({'type': GUI_ANSWER, 'id': request['id'], 'userid': result['userid'], 'printjob': result['printjob'], 'selected': result['selected']})
+		except ProtocolError, e:
+			log.warn('Could not send the answer to the popup server: %s' %e)
+			app.ExitMainLoop()
+
+	def showPopup(request):
+		try:
+			app.frame.ask(request['jobs'], request.get('cachedid'), lambda result: answer(request, result))
+			channel.send({'type': GUI_SHOWN, 'id': request['id']})
+		except ProtocolError, e:
+			log.warn('Could not tell the popup server the popup is shown: %s' %e)
+			app.ExitMainLoop()
+		except Exception, e:
+			log.warn('Error showing the popup: %s' %e)
+			answer(request, {'userid': None, 'printjob': False, 'selected': [False] * len(request['jobs'])})
+
+	def receiveRequests():
+		try:
+			while True:
+				request = channel.receive()
+				if request is None:
+					break
+				if request['type'] == GUI_ASK:
+					wx.CallAfter(showPopup, request)
+		except ProtocolError, e:
+			log.warn('Connection to the popup server failed: %s' %e)
+		wx.CallAfter(app.ExitMainLoop)
+
+	receiver = threading.Thread(target=receiveRequests, name='receiver')
+	receiver.setDaemon(True)
+	receiver.start()
+	app.MainLoop()
+	app.frame.Destroy()
+	channel.close()
+	return 0
@@ -0,0 +1,299 @@
+#!/usr/bin/python2
+# Script Name: popupprotocol.py
+# Script Function:
+#	This script provides the wire protocol between the pharos backend and the popup server.
+#	Every message is a frame made of a header (magic, protocol version, payload length)
+#	followed by a JSON object payload, so a connection can carry several requests and
+#	replies and partial reads are handled. Requests in the old plain text format
+#	(GetPrintJobParameters) are still understood by the popup server.
+#	Each popup server listens on a Unix socket in its session's runtime directory,
+#	<runtime dir>/pharos/popup-<session>.sock, and registers it with the pharosbroker
+#	daemon. The backend asks the broker, which routes the request to the session of the
+#	job's user, or finds the user's session sockets itself. TCP is the fallback transport
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'popupprotocol'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import json
+import stat
+import errno
+import socket
+import struct
+
+# Script Variables ======================
+MESSAGE_MAGIC = 'PHRS'
+PROTOCOL_VERSION = 1
+HEADER_FORMAT = '!4sBI'
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+MAX_MESSAGE_SIZE = 65536
+
+# Socket of the pharosbroker daemon
+BROKER_SOCKET_PATH = '/run/pharos/broker.sock'
+SO_PEERCRED = getattr(socket, 'SO_PEERCRED', 17)
+
+# Session sockets of the popup servers
+SESSION_SOCKET_DIR_NAME = 'pharos'
+SESSION_SOCKET_PREFIX = 'popup-'
+SESSION_SOCKET_SUFFIX = '.sock'
+
+# Message types
+REQUEST_PRINT_JOB_PARAMETERS = 'GetPrintJobParameters'
+REPLY_PRINT_JOB_PARAMETERS = 'PrintJobParameters'
+REQUEST_REGISTER = 'Register'
+REPLY_REGISTERED = 'Registered'
+REQUEST_STATUS = 'GetStatus'
+REPLY_STATUS = 'Status'
+# Between the popup server and its GUI process
+GUI_ASK = 'Ask'
+GUI_SHOWN = 'Shown'
+GUI_ANSWER = 'Answer'
+REPLY_ERROR = 'Error'
+
+# Reasons given in Error replies
+POPUP_ERROR_NO_SESSION = 'nosession'
+POPUP_ERROR_DENIED = 'denied'
+POPUP_ERROR_UNKNOWN = 'unknown'
+
+# Error reasons reported by ProtocolError
+PROTOCOL_ERROR_TIMEOUT = 'timeout'
+PROTOCOL_ERROR_CLOSED = 'closed'
+PROTOCOL_ERROR_FORMAT = 'format'
+PROTOCOL_ERROR_VERSION = 'version'
+PROTOCOL_ERROR_IO = 'io'
+
+# Function Declaration ==================
+def getRuntimeDIR(uid):
+	"""
+	Returns the runtime directory of the user with the given uid
+	"""
+	if uid == os.getuid() and os.environ.get('XDG_RUNTIME_DIR'):
+		return os.environ['XDG_RUNTIME_DIR']
+	return '/run/user/%d' %uid
+
+def getSessionSocketDIR(uid):
+	"""
+	Returns the directory holding the session sockets of the user with the given uid
+	"""
+	return os.path.join(getRuntimeDIR(uid), SESSION_SOCKET_DIR_NAME)
+
+def getSessionSocketPath(uid, sessionID):
+	"""
+	Returns the socket path of the popup server of the given session
+	"""
+	return os.path.join(getSessionSocketDIR(uid), SESSION_SOCKET_PREFIX + sessionID + SESSION_SOCKET_SUFFIX)
+
+def findSessionSockets(log, userName):
+	"""
+	Returns the session sockets owned by the user, most recently started session first
+	"""
+	import pwd
+	try:
+		uid = pwd.getpwnam(userName).pw_uid
+	except KeyError:
+		log.info('%s is not a local user, no session sockets' %userName)
+		return []
+	socketDIR = getSessionSocketDIR(uid)
+	try:
+		names = os.listdir(socketDIR)
+	except OSError, e:
+		log.info('Could not list session sockets in %s: %s' %(socketDIR, e.strerror))
+		return []
+	sockets = []
+	for name in names:
+		if not (name.startswith(SESSION_SOCKET_PREFIX) and name.endswith(SESSION_SOCKET_SUFFIX)):
+			continue
+		path = os.path.join(socketDIR, name)
+		try:
+			st = os.lstat(path)
+		except OSError:
+			continue
+		if stat.S_ISSOCK(st.st_mode) and st.st_uid == uid:
+			sockets.append((st.st_mtime, path))
+	sockets.sort(reverse=True)
+	return [path for mtime, path in sockets]
+
+def getPeerCredentials(sock):
+	"""
+	Returns the (pid, uid, gid) of the process at the other end of a Unix socket
+	"""
+	return struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, SO_PEERCRED, struct.calcsize('3i')))
+
+def getJobLabel(job):
+	"""
+	Returns the line describing a print job request to the user
+	"""
+	label = job.get('title') or 'Job %s' %job.get('job')
+	details = []
+	if job.get('copies') and str(job['copies']) != '1':
+		details.append('%s copies' %job['copies'])
+	if job.get('size'):
+		details.append('%d KB' %max(1, int(job['size']) // 1024))
+	if details:
+		label = '%s (%s)' %(label, ', '.join(details))
+	return label
+
+def connectPopupServer(log, userName, host, port, timeout, brokerPath=None, tcpFallback=True):
+	"""
+	Connects to the broker when brokerPath is given and it is running, else to the popup
+	server in the session of the job's user over its Unix socket, else over TCP when
+	tcpFallback is on. Returns the connected socket and the address used. Raises
+	socket.error when no connection could be made
+	"""
+	paths = findSessionSockets(log, userName)
+	if brokerPath:
+		paths.insert(0, brokerPath)
+	for path in paths:
+		s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		s.settimeout(timeout)
+		try:
+			s.connect(path)
+			return s, path
+		except socket.error, e:
+			s.close()
+			log.info('Could not connect to %s: %s' %(path, e))
+	if not tcpFallback:
+		raise socket.error(errno.ENOENT, 'No popup server session of %s found' %userName)
+	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	s.settimeout(timeout)
+	try:
+		s.connect((host, port))
+	except socket.error:
+		s.close()
+		raise
+	return s, '%s:%d' %(host, port)
+
+# Class definitions =====================
+class ProtocolError(Exception):
+	"""
+	Raised when a message can not be sent or received. The reason is one of the PROTOCOL_ERROR_* values
+	"""
+	def __init__(self, reason, message):
+		Exception.__init__(self, message)
+		self.reason = reason
+		self.message = message
+
+class MessageChannel:
+	"""
+	Sends and receives framed messages (dictionaries) over a connected socket.
+	With acceptLegacy, a peer sending the old plain text request is answered in the old format
+	"""
+	def __init__(self, log, sock, timeout=None, acceptLegacy=False):
+		"""
+		Constructor
+		"""
+		self.logger = log
+		self.s = sock
+		self.s.settimeout(timeout)
+		self.acceptLegacy = acceptLegacy
+		self.legacy = False
+		self.bytesSent = 0
+		self.bytesReceived = 0
+
+	def setTimeout(self, timeout):
+		"""
+		Sets the timeout in seconds for each following send and receive, None waits forever
+		"""
+		self.s.settimeout(timeout)
+
+	def send(self, message):
+		"""
+		Sends the message dictionary as one frame
+		"""
+		if self.legacy and message.get('type') == REPLY_ERROR:
+			frame = 'UNKNOWN'
+		elif self.legacy:
+			frame = 'userid:%s,printjob:%s' %(message.get('userid'), message.get('printjob') and 'yes' or 'no')
+		else:
+			payload = json.dumps(message, separators=(',', ':'))
+			if len(payload) > MAX_MESSAGE_SIZE:
+				raise ProtocolError(PROTOCOL_ERROR_FORMAT, 'Message of %d bytes is too large' %len(payload))
+			frame = struct.pack(HEADER_FORMAT, MESSAGE_MAGIC, PROTOCOL_VERSION, len(payload)) + payload
+		try:
+			self.s.sendall(frame)
+		except socket.timeout:
+			raise ProtocolError(PROTOCOL_ERROR_TIMEOUT, 'Timed out sending %s message' %message.get('type'))
+		except socket.error, e:
+			raise ProtocolError(PROTOCOL_ERROR_IO, 'Could not send %s message: %s' %(message.get('type'), e))
+		self.bytesSent += len(frame)
+
+	def receive(self):
+		"""
+		Receives the next message and returns it as a dictionary with at least a type.
+		Returns None when the peer closed the connection between messages
+		"""
+		header = self.receiveExactly(HEADER_SIZE, allowClose=True)
+		if header is None:
+			return None
+		if not header.startswith(MESSAGE_MAGIC):
+			if self.acceptLegacy:
+				return self.receiveLegacy(header)
+			raise ProtocolError(PROTOCOL_ERROR_FORMAT, 'Received data that is not a pharos message')
+		magic, version, length = struct.unpack(HEADER_FORMAT, header)
+		if version != PROTOCOL_VERSION:
+			raise ProtocolError(PROTOCOL_ERROR_VERSION, 'Unsupported protocol version %d (supported: %d)' %(version, PROTOCOL_VERSION))
+		if length > MAX_MESSAGE_SIZE:
+			raise ProtocolError(PROTOCOL_ERROR_FORMAT, 'Message of %d bytes is too large' %length)
+		payload = self.receiveExactly(length)
+		try:
+			message = json.loads(payload)
+		except ValueError, e:
+			raise ProtocolError(PROTOCOL_ERROR_FORMAT, 'Could not decode message: %s' %e)
+		if not isinstance(message, dict) or 'type' not in message:
+			raise ProtocolError(PROTOCOL_ERROR_FORMAT, 'Message has no type')
+		return message
+
+	def receiveExactly(self, count, allowClose=False):
+		"""
+		Reads exactly count bytes, however the peer splits them. With allowClose, returns None
+		when the connection is closed before the first byte
+		"""
+		chunks = []
+		received = 0
+		while received < count:
+			try:
+				chunk = self.s.recv(count - received)
+			except socket.timeout:
+				raise ProtocolError(PROTOCOL_ERROR_TIMEOUT, 'Timed out waiting for a message')
+			except socket.error, e:
+				raise ProtocolError(PROTOCOL_ERROR_IO, 'Could not receive message: %s' %e)
+			if not chunk:
+				if allowClose and received == 0:
+					return None
+				raise ProtocolError(PROTOCOL_ERROR_CLOSED, 'Connection closed after %d of %d bytes' %(received, count))
+			chunks.append(chunk)
+			received += len(chunk)
+		self.bytesReceived += received
+		return ''.join(chunks)
+
+	def receiveLegacy(self, start):
+		"""
+		Reads the rest of an old plain text request whose first bytes are in start.
+		The old backend sends the bare command and waits for the reply
+		"""
+		try:
+			data = start + self.s.recv(1024)
+		except socket.error:
+			data = start
+		self.legacy = True
+		self.bytesReceived += len(data)
+		parts = data.strip().split(' ', 1)
+		message = {'type': parts[0]}
+		if len(parts) > 1:
+			message['trace'] = parts[1].strip()
+		self.logger.info('Received legacy request %s' %message['type'])
+		return message
+
+	def close(self):
+		"""
+		Closes the connection
+		"""
+		try:
+			self.s.close()
+		except socket.error:
+			pass
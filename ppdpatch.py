@@ -0,0 +1,158 @@
+#!/usr/bin/python2
+# Script Name: ppdpatch.py
+# Script Function:
+#	This script edits the PPD file of a print queue. The file is read once into a list of
+#	lines indexed by main keyword, every edit is applied to that model, and the result is
+#	written to a temporary file next to the PPD that replaces it by a rename, so cupsd never
+#	reads a half written PPD. The owner and permissions of the PPD are kept, and gzip
+#	compressed PPDs are read and written compressed
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+__name__ = 'ppdpatch'
+__version__ = '1.0'
+
+# Imports ===============================
+
+import os
+import gzip
+import tempfile
+
+# Script Variables ======================
+GZIP_MAGIC = '\x1f\x8b'
+
+# Class definitions =====================
+class PPDError(Exception):
+	"""
+	Raised when a PPD file can not be read or written
+	"""
+	def __init__(self, message):
+		Exception.__init__(self, message)
+		self.message = message
+
+class PPDFile:
+	"""
+	The lines of a PPD file and the index of its *Keyword: value lines
+	"""
+	def __init__(self, log, path):
+		"""
+		Constructor
+		"""
+		self.logger = log
+		self.path = path
+		self.lines = []
+		self.keywords = {}
+		self.compressed = False
+		self.changed = 0
+
+	def load(self):
+		"""
+		Reads and indexes the PPD file
+		"""
+		try:
+			ppd = open(self.path, 'rb')
+			try:
+				self.compressed = ppd.read(2) == GZIP_MAGIC
+			finally:
+				ppd.close()
+			if self.compressed:
+				ppd = gzip.open(self.path, 'rb')
+			else:
+				ppd = open(self.path, 'rb')
+			try:
+				self.lines = ppd.readlines()
+			finally:
+				ppd.close()
+		except IOError, e:
+			raise PPDError('Could not read ppd file %s: %s' %(self.path, e))
+		self.keywords = {}
+		for index, line in enumerate(self.lines):
+			keyword = self.getKeyword(line)
+			if keyword:
+				self.keywords.setdefault(keyword, []).append(index)
+		self.changed = 0
+		return self
+
+	def getKeyword(self, line):
+		"""
+		Returns the main keyword of a *Keyword: value line without its *, None for comments
+		and lines continuing a value
+		"""
+		if not line.startswith('*') or line.startswith('*%') or ':' not in line:
+			return None
+		return line[1:].split(':', 1)[0].split()[0]
+
+	def getValue(self, keyword):
+		"""
+		Returns the value of the first line with the keyword, None when there is none
+		"""
+		for index in self.keywords.get(keyword, []):
+			return self.lines[index].split(':', 1)[1].strip()
+		return None
+
+	def setValue(self, keyword, value, oldValue=None):
+		"""
+		Sets the value of the keyword's lines that have no option, and with oldValue only of
+		those whose value is oldValue. Returns the number of lines changed
+		"""
+		changed = 0
+		for index in self.keywords.get(keyword, []):
+			line = self.lines[index]
+			if line[1:].split(':', 1)[0].strip() != keyword:
+				continue
+			current = line.split(':', 1)[1].strip()
+			if current == value or (oldValue is not None and current != oldValue):
+				continue
+			ending = line[len(line.rstrip('\r\n')):] or '\n'
+			self.lines[index] = '*%s: %s%s' %(keyword, value, ending)
+			changed += 1
+		self.changed += changed
+		return changed
+
+	def apply(self, edits):
+		"""
+		Applies the (keyword, old value or None, new value) edits in order and returns the
+		number of lines changed
+		"""
+		changed = 0
+		for keyword, oldValue, value in edits:
+			count = self.setValue(keyword, value, oldValue)
+			if count:
+				self.logger.info('Set %s to %s in ppd file %s' %(keyword, value, self.path))
+			changed += count
+		return changed
+
+	def save(self):
+		"""
+		Replaces the PPD file with the edited lines when anything changed
+		"""
+		if not self.changed:
+			self.logger.info('ppd file %s is unchanged' %self.path)
+			return
+		try:
+			st = os.stat(self.path)
+			handle, tempPath = tempfile.mkstemp(prefix='.%s.' %os.path.basename(self.path), dir=os.path.dirname(self.path))
+		except (IOError, OSError), e:
+			raise PPDError('Could not create temporary file for ppd file %s: %s' %(self.path, e))
+		try:
+			tempFile = os.fdopen(handle, 'wb')
+			try:
+				if self.compressed:
+					ppd = gzip.GzipFile(os.path.basename(self.path), 'wb', fileobj=tempFile)
+					ppd.writelines(self.lines)
+					ppd.close()
+				else:
+					tempFile.writelines(self.lines)
+			finally:
+				tempFile.close()
+			os.chmod(tempPath, st.st_mode & 07777)
+			if os.getuid() == 0:
+				os.chown(tempPath, st.st_uid, st.st_gid)
+			os.rename(tempPath, self.path)
+		except (IOError, OSError), e:
+			if os.path.exists(tempPath):
+				os.remove(tempPath)
+			raise PPDError('Could not write ppd file %s: %s' %(self.path, e))
+		self.logger.info('Saved %d changed lines in ppd file %s' %(self.changed, self.path))
+		self.changed = 0
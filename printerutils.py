@@ -13,21 +13,148 @@ __version__ = '1.0'
 
 import subprocess
 import re
-import tempfile
 import os
-import shutil
 import stat
+import threading
+import hashlib
+
+# Script Variables ======================
+cupsPrintersConfigFile = '/etc/cups/printers.conf'
+cupsOptionsFile = '/etc/cups/lpoptions'
+# printers.conf keywords and the attribute names lpoptions -p reports them under
+printersConfigAttributes = {
+	'DeviceURI': 'device-uri',
+	'Info': 'printer-info',
+	'Location': 'printer-location',
+	'MakeModel': 'printer-make-and-model',
+	'State': 'printer-state',
+	'Accepting': 'printer-is-accepting-jobs',
+	'Shared': 'printer-is-shared',
+}
+printerStateValues = {'idle': '3', 'processing': '4', 'stopped': '5'}
+cupsPPDDIR = '/etc/cups/ppd'
+# lpoptions rewrites the whole lpoptions file, queues installed in parallel take turns
+lpoptionsLock = threading.Lock()
+# PPD edits (keyword, old value, new value) for HP printers
+hpDuplexerEdits = [('DefaultOptionDuplex', 'False', 'True'), ('cupsEvenDuplex', 'True', 'False')]
+hpDefaultDuplexEdits = [('DefaultDuplex', 'None', 'DuplexNoTumble'), ('DefaultOptionDuplex', 'False', 'True')]
+
+# Function Declaration ==================
+def formatAttributeValue(value):
+	"""
+	Returns an IPP attribute value as lpoptions -p shows it
+	"""
+	if isinstance(value, list):
+		return ','.join([formatAttributeValue(item) for item in value])
+	if isinstance(value, bool):
+		return value and 'true' or 'false'
+	return str(value)
+
+def getFingerprintDigest(fingerprint):
+	"""
+	Returns a short digest of a print queue fingerprint for the logs
+	"""
+	return hashlib.sha1(repr(sorted(fingerprint.items()))).hexdigest()[:12]
 
 # Class definitions =====================
+class PrinterSnapshot:
+	"""
+	The settings of every print queue read in one pass, indexed by queue name and by the
+	scheme of the queue's device URI (pharos, lpd, usb, socket, ...)
+	"""
+	def __init__(self, printers):
+		"""
+		Constructor
+		"""
+		self.printers = printers
+		self.schemes = {}
+		for printer, settings in printers.items():
+			scheme = settings.get('device-uri', '').split(':', 1)[0].lower()
+			self.schemes.setdefault(scheme, []).append(printer)
+		for printerList in self.schemes.values():
+			printerList.sort()
+
+	def __contains__(self, printer):
+		"""
+		Checks if the print queue exists
+		"""
+		return printer in self.printers
+
+	def names(self):
+		"""
+		Returns the names of all print queues
+		"""
+		return sorted(self.printers.keys())
+
+	def get(self, printer):
+		"""
+		Returns the settings of the print queue, None when it does not exist
+		"""
+		return self.printers.get(printer)
+
+	def printersWithScheme(self, scheme):
+		"""
+		Returns the print queues whose device URI uses the given scheme
+		"""
+		return list(self.schemes.get(scheme.lower(), []))
+
 class PrinterUtility:
 	def __init__(self, log):
 		self.logger = log
+		# IPP client talking to cupsd, False once the CUPS command line tools have to be used
+		self.ipp = None
+		# Index of the installed drivers, loaded on the first driver lookup
+		self.driverIndex = None
 	
+	def getIPPClient(self):
+		"""
+		Returns the IPP client that talks to cupsd over its domain socket, or None when the
+		CUPS command line tools have to be used
+		"""
+		if self.ipp is None:
+			from ippclient import IPPClient, getCupsSocketPath
+			self.ipp = False
+			if getCupsSocketPath():
+				self.ipp = IPPClient(self.logger)
+		return self.ipp or None
+
+	def ippFailed(self, e):
+		"""
+		Handles a failed IPP request. When cupsd could not be reached or refused the request,
+		the CUPS command line tools are used from now on and True is returned so that the
+		caller retries with them
+		"""
+		from ippclient import IPP_ERROR_STATUS
+		if e.reason == IPP_ERROR_STATUS:
+			return False
+		self.logger.warn('Could not talk to cupsd over IPP (%s): %s. Using the CUPS command line tools' %(e.reason, e.message))
+		self.ipp.close()
+		self.ipp = False
+		return True
+
+	def close(self):
+		"""
+		Closes the connection to cupsd
+		"""
+		if self.ipp:
+			self.ipp.close()
+
 	def printerExists(self, printer):
 		"""
 		Checks if the given printer device exists
 		"""		
 		self.logger.info('Checking if printer %s exists' %printer)
+		ipp = self.getIPPClient()
+		if ipp:
+			from ippclient import IPPError
+			try:
+				exists = ipp.getPrinterAttributes(printer, ['printer-name']) is not None
+				self.logger.info('Printer %s exists: %s' %(printer, exists))
+				return exists
+			except IPPError as e:
+				if not self.ippFailed(e):
+					self.logger.error('Could not check if printer %s exists: %s' %(printer, e.message))
+					return False
 		printerExistsCommand = ['lpoptions', '-d', printer]
 		
 		self.logger.info('Checking if printer %s already exists using command %s' %(printer, printerExistsCommand))
@@ -50,6 +177,19 @@ class PrinterUtility:
 		Deletes the given printer device
 		"""
 		self.logger.info('Trying to delete printer device %s' %printer)
+		ipp = self.getIPPClient()
+		if ipp:
+			from ippclient import IPPError, IPP_STATUS_NOT_FOUND
+			try:
+				ipp.deletePrinter(printer)
+				return True
+			except IPPError as e:
+				if e.status == IPP_STATUS_NOT_FOUND:
+					self.logger.info('Printer %s does not exist' %printer)
+					return True
+				if not self.ippFailed(e):
+					self.logger.error('Could not delete printer %s: %s' %(printer, e.message))
+					return False
 		deletePrinterCommand = ['lpadmin', '-x', printer]
 		self.logger.info('Trying to delete printer %s using command %s' %(printer, deletePrinterCommand))
 		try:
@@ -68,6 +208,18 @@ class PrinterUtility:
 		"""
 		Enables printer device
 		"""
+		ipp = self.getIPPClient()
+		if ipp:
+			from ippclient import IPPError
+			self.logger.info('Trying to enable printer %s using IPP' %printer)
+			try:
+				ipp.acceptJobs(printer)
+				ipp.resumePrinter(printer)
+				return True
+			except IPPError as e:
+				if not self.ippFailed(e):
+					self.logger.error('Could not enable printer %s: %s' %(printer, e.message))
+					return False
 		
 		acceptPrinterCommand = ['cupsaccept', printer]
 		self.logger.info('Trying to enable printer %s using command %s' %(printer, acceptPrinterCommand))
@@ -89,6 +241,54 @@ class PrinterUtility:
 		
 		return True
 	
+	def getDeviceURI(self, printer):
+		"""
+		Returns the device URI of the print queue. LPDServer may list several servers
+		separated by commas
+		"""
+		lpdServers = ','.join([server.strip() for server in printer['lpdserver'].split(',') if server.strip()])
+		return 'pharos://' + lpdServers + '/' + printer['lpdqueue']
+
+	def getPPDEdits(self, printer):
+		"""
+		Returns the edits to the ppd file of the print queue for its duplex settings
+		"""
+		ppdEdits = []
+		
+		# Enable Duplex if needed
+		if printer.has_key('duplexerinstalled'):
+			# check if HP printer
+			if printer.has_key('make'):
+				if printer['make'] in ['hp', 'HP', 'Hp', 'hP']:
+					self.logger.info('Processing duplex printing for HP printer')						
+					if printer['duplexerinstalled'] in ['yes', 'Yes', 'yEs', 'yeS', 'YEs', 'yES', 'YES']:
+						self.logger.info('Enabling duplex unit for HP printer %s' %printer['printqueue'])
+						ppdEdits.extend(hpDuplexerEdits)
+				else:
+					self.logger.info('Printer make %s is not special case. Will only process defaultduplex setting' %printer['make'])
+			else:
+				self.logger.warn('Printer Make is not specified. Will only process defaultduplex setting')
+		
+		# Default Duplex Printing
+		if printer.has_key('defaultduplex'):
+			if printer['defaultduplex'] in ['yes', 'Yes', 'yEs', 'yeS', 'YEs', 'yES', 'YES']:
+				# check if HP printer
+				if printer.has_key('make'):
+					if printer['make'] in ['hp', 'HP', 'Hp', 'hP']:
+						self.logger.info('Setting default duplex printing for HP printer %s' %printer['printqueue'])
+						ppdEdits.extend(hpDefaultDuplexEdits)
+		
+		return ppdEdits
+
+	def getManagedPPDEdits(self, printer):
+		"""
+		Returns every edit getPPDEdits can make to the ppd file of the print queue, whether
+		printers.conf asks for it or not, so that edits no longer wanted can be found
+		"""
+		if printer.get('make') in ['hp', 'HP', 'Hp', 'hP']:
+			return hpDuplexerEdits + hpDefaultDuplexEdits
+		return []
+
 	def installPrintQueue(self, printer):
 		"""
 		Install a print queue	
@@ -120,7 +320,7 @@ class PrinterUtility:
 					
 			self.logger.info('Using driver path %s' %printerDriverPath)
 			# Build lpadmin Command
-			deviceURI = 'pharos://' + printer['lpdserver'] + '/' + printer['lpdqueue']
+			deviceURI = self.getDeviceURI(printer)
 			lpadminCommand = ['lpadmin', '-E', '-p', printer['printqueue'] , '-v', deviceURI, '-m', printerDriverPath]
 			if printer['location'] != None:
 				lpadminCommand.append('-L')
@@ -129,42 +329,35 @@ class PrinterUtility:
 				lpadminCommand.append('-D')
 				lpadminCommand.append(printer['description'])			
 			
-			# Run lpadmin command
-			try:
-				self.logger.info('Adding printer using lpadmin command: %s' %lpadminCommand)
-				lpadmin = subprocess.check_output(lpadminCommand)
-				self.logger.info('command result = %s' %lpadmin)
-			except subprocess.CalledProcessError:
-				self.logger.error('Could not add printer using lpadmin')
+			# Add the printer over IPP, else run lpadmin command
+			ipp = self.getIPPClient()
+			if ipp:
+				from ippclient import IPPError
+				try:
+					self.logger.info('Adding printer %s with device uri %s and driver %s using IPP' %(printer['printqueue'], deviceURI, printerDriverPath))
+					ipp.addModifyPrinter(printer['printqueue'], deviceURI=deviceURI, ppdName=printerDriverPath, location=printer['location'], info=printer['description'], enable=True)
+				except IPPError as e:
+					if not self.ippFailed(e):
+						self.logger.error('Could not add printer using IPP: %s' %e.message)
+					ipp = self.getIPPClient()
+			if not ipp:
+				try:
+					self.logger.info('Adding printer using lpadmin command: %s' %lpadminCommand)
+					lpadmin = subprocess.check_output(lpadminCommand)
+					self.logger.info('command result = %s' %lpadmin)
+				except subprocess.CalledProcessError:
+					self.logger.error('Could not add printer using lpadmin')
 			
-			# Enable Duplex if needed
-			if printer.has_key('duplexerinstalled'):
-				# check if HP printer
-				if printer.has_key('make'):
-					if printer['make'] in ['hp', 'HP', 'Hp', 'hP']:
-						self.logger.info('Processing duplex printing for HP printer')						
-						if printer['duplexerinstalled'] in ['yes', 'Yes', 'yEs', 'yeS', 'YEs', 'yES', 'YES']:
-							if self.setDuplexerForHPPrinter(printer['printqueue']):
-								self.logger.info('successfully set duplexer for hp printer %s' %printer['printqueue'])
-							else:
-								self.logger.error('Could not set duplexer for hp printer %s' %printer['printqueue'])
-					else:
-						self.logger.info('Printer make %s is not special case. Will only process defaultduplex setting' %printer['make'])
+			# The edits to the ppd file of HP printers are applied together
+			ppdEdits = self.getPPDEdits(printer)
+			if ppdEdits:
+				if self.patchPrinterPPD(printer['printqueue'], ppdEdits):
+					self.logger.info('successfully set duplex options in ppd of hp printer %s' %printer['printqueue'])
 				else:
-					self.logger.warn('Printer Make is not specified. Will only process defaultduplex setting')
-				
-			# Default Duplex Printing
+					self.logger.error('Could not set duplex options in ppd of hp printer %s' %printer['printqueue'])
+			
 			if printer.has_key('defaultduplex'):
 				if printer['defaultduplex'] in ['yes', 'Yes', 'yEs', 'yeS', 'YEs', 'yES', 'YES']:
-					# check if HP printer
-					if printer.has_key('make'):
-						if printer['make'] in ['hp', 'HP', 'Hp', 'hP']:
-							self.logger.info('Setting default duplex printing for HP printer %s' %printer['printqueue'])
-							if self.setDefaultDuplexPrintingForHPPrinter(printer['printqueue']):
-								self.logger.info('successfully set default duplex printing for hp printer %s' %printer['printqueue'])
-							else:
-								self.logger.error('Could not set default duplex printing for hp printer %s' %printer['printqueue'])
-					
 					if self.setDefaultDuplexPrinting(printer['printqueue']):
 						self.logger.info('Successfully enabled duplexing for printer %s' %printer['printqueue'])
 					else:
@@ -187,6 +380,102 @@ class PrinterUtility:
 			self.logger.info('Could not find the required driver installed on the system. Cannot install printer')
 			return False		
 
+	def getPrintQueueFingerprint(self, printer):
+		"""
+		Returns the fingerprint of the print queue the printer properties define: the settings
+		that are compared with the installed queue. Returns None when a required property is
+		missing or the driver is not installed
+		"""
+		for required in ['driver', 'model', 'lpdserver', 'lpdqueue']:
+			if printer.get(required) == None:
+				self.logger.error('Required parameter %s of printer %s is missing' %(required, printer['printqueue']))
+				return None
+		driverName = self.isDriverInstalled(printer['model'], printer['driver'])
+		if driverName == '':
+			return None
+		fingerprint = {
+			'device-uri': self.getDeviceURI(printer),
+			'printer-make-and-model': self.getDriverIndex().getMakeAndModel(driverName),
+			'printer-location': printer.get('location') or '',
+			'printer-info': printer.get('description') or '',
+		}
+		# Settings printers.conf does not ask for are empty, so removing them is a difference too
+		fingerprint['ppd'] = tuple(sorted(set(self.getPPDEdits(printer))))
+		fingerprint['duplex'] = ''
+		if printer.get('defaultduplex') in ['yes', 'Yes', 'yEs', 'yeS', 'YEs', 'yES', 'YES']:
+			fingerprint['duplex'] = 'DuplexNoTumble'
+		return fingerprint
+
+	def getInstalledFingerprint(self, printer, settings, fingerprint):
+		"""
+		Returns the fingerprint of the installed print queue of the printer properties, with
+		its settings from a PrinterSnapshot, for the keys of the given fingerprint. A setting
+		the queue does not have, as printers.conf leaves out an empty Location or Info, counts
+		as empty. The ppd edits are those the ppd file has. A ppd that could not be read is
+		left out so it is not compared
+		"""
+		installed = {}
+		for key in fingerprint:
+			if key == 'ppd':
+				managedEdits = set(self.getManagedPPDEdits(printer)) | set(fingerprint['ppd'])
+				if not managedEdits:
+					installed['ppd'] = ()
+					continue
+				from ppdpatch import PPDFile, PPDError
+				try:
+					ppd = PPDFile(self.logger, os.path.join(cupsPPDDIR, printer['printqueue'] + '.ppd')).load()
+				except PPDError as e:
+					self.logger.warn(e.message)
+					continue
+				# A wanted edit is made unless the ppd still has the value it replaces, an edit
+				# no longer wanted is made when the ppd has the value it sets
+				applied = []
+				for edit in managedEdits:
+					keyword, oldValue, value = edit
+					if edit in fingerprint['ppd'] and ppd.getValue(keyword) != oldValue:
+						applied.append(edit)
+					elif edit not in fingerprint['ppd'] and ppd.getValue(keyword) == value:
+						applied.append(edit)
+				installed['ppd'] = tuple(sorted(applied))
+			elif key == 'duplex':
+				installed['duplex'] = settings.get('duplex', '')
+			elif key in settings:
+				installed[key] = settings[key]
+			elif fingerprint[key] is not None:
+				installed[key] = ''
+		return installed
+
+	def modifyPrintQueue(self, printer, deviceURI=None, location=None, info=None):
+		"""
+		Changes the device URI, location or description of an installed print queue, leaving
+		its driver, ppd and jobs alone
+		"""
+		self.logger.info('Modifying printer %s' %printer)
+		ipp = self.getIPPClient()
+		if ipp:
+			from ippclient import IPPError
+			try:
+				ipp.addModifyPrinter(printer, deviceURI=deviceURI, location=location, info=info)
+				return True
+			except IPPError as e:
+				if not self.ippFailed(e):
+					self.logger.error('Could not modify printer %s: %s' %(printer, e.message))
+					return False
+		lpadminCommand = ['lpadmin', '-p', printer]
+		if deviceURI != None:
+			lpadminCommand.extend(['-v', deviceURI])
+		if location != None:
+			lpadminCommand.extend(['-L', location])
+		if info != None:
+			lpadminCommand.extend(['-D', info])
+		self.logger.info('Modifying printer using lpadmin command: %s' %lpadminCommand)
+		try:
+			subprocess.check_output(lpadminCommand)
+		except subprocess.CalledProcessError:
+			self.logger.error('Could not modify printer %s using lpadmin' %printer)
+			return False
+		return True
+
 	def queryPrinterOption(self, printer, option='all'):
 		"""
 		Queries the printer for a specific option or all options
@@ -195,19 +484,33 @@ class PrinterUtility:
 		value = ''
 		allOptionsDictionary = {}
 		self.logger.info('Querying printer %s for option %s' %(printer, option))
-		try:
-			lpoption = subprocess.check_output(queryCommand)
-			allOptions = lpoption.split(' ')			
-			for pOption in allOptions:
-				if re.search('=', pOption):
-					allOptionsDictionary[pOption.split('=')[0].strip()] = pOption.split('=')[1].strip()
-			
-			if option != 'all':
-				if allOptionsDictionary.has_key(option):
-					value = allOptionsDictionary[option]
-				
-		except subprocess.CalledProcessError:
-			self.logger.error('Could not set option %s with value %s printer %s' %(option, value, printer))			
+		ipp = self.getIPPClient()
+		if ipp:
+			from ippclient import IPPError
+			try:
+				attributes = ipp.getPrinterAttributes(printer, printersConfigAttributes.values() + ['printer-name']) or {}
+				for name, attributeValue in attributes.items():
+					allOptionsDictionary[name] = formatAttributeValue(attributeValue)
+				# Options saved with lpoptions -p live in the lpoptions file, not in cupsd
+				printers = {printer: allOptionsDictionary}
+				self.readPrinterOptions(cupsOptionsFile, printers)
+			except IPPError as e:
+				if not self.ippFailed(e):
+					self.logger.error('Could not query printer %s: %s' %(printer, e.message))
+				ipp = self.getIPPClient()
+		if not ipp:
+			try:
+				lpoption = subprocess.check_output(queryCommand)
+				allOptions = lpoption.split(' ')			
+				for pOption in allOptions:
+					if re.search('=', pOption):
+						allOptionsDictionary[pOption.split('=')[0].strip()] = pOption.split('=')[1].strip()
+			except subprocess.CalledProcessError:
+				self.logger.error('Could not set option %s with value %s printer %s' %(option, value, printer))			
+		
+		if option != 'all':
+			if allOptionsDictionary.has_key(option):
+				value = allOptionsDictionary[option]
 		
 		if option != 'all':
 			if value != '':
@@ -225,7 +528,8 @@ class PrinterUtility:
 		printerOptionCommand = ['lpoptions', '-p', printer, '-o', optionString]
 		self.logger.info('Running lptions command %s' %printerOptionCommand)
 		try:
-			lpoption = subprocess.check_output(printerOptionCommand)
+			with lpoptionsLock:
+				lpoption = subprocess.check_output(printerOptionCommand)
 		except subprocess.CalledProcessError:
 			self.logger.error('Could not set option %s with value %s printer %s' %(option, value, printer))		
 			return False
@@ -237,114 +541,40 @@ class PrinterUtility:
 		else:
 			self.logger.warn('The option %s has been incorrectly setup to %s for printer %s' %(option, currentValue, printer))
 	
-	def setDuplexerForHPPrinter(self, printer):
+	def patchPrinterPPD(self, printer, edits):
 		"""
-		Enables the Duplexing unit for the HP printer
+		Applies the (keyword, old value, new value) edits to the ppd file of the printer in one
+		pass and replaces the file atomically
 		"""
-		self.logger.info('Enabling duplex unit for HP printer %s' %printer)
-		
-		# Update the driver ppd
-		ppdFile = os.path.join('/etc/cups/ppd', printer + '.ppd')
-		newppdFile = tempfile.NamedTemporaryFile(delete=False)
-		
-		self.logger.info('Checking if ppd file %s exists' %ppdFile)
-		if os.path.exists(ppdFile):
-			self.logger.info('ppd file %s exists' %ppdFile)
-			ppd = open(ppdFile, 'r')
-			for line in ppd:				
-				if line.startswith("*DefaultOptionDuplex: False", 0, len("*DefaultOptionDuplex: False")):
-					newppdFile.writelines('*DefaultOptionDuplex: True\n')
-				elif line.startswith("*cupsEvenDuplex: True", 0, len("*cupsEvenDuplex: True")):
-					newppdFile.writelines('*cupsEvenDuplex: False\n')
-				else:
-					newppdFile.writelines(line)
-			newppdFile.close()
-			ppd.close()
-			self.logger.info('successfully created file %s' %newppdFile.name)
-			try:				
-				shutil.copy(newppdFile.name, ppdFile)
-				self.logger.info('Successfully copied the modified ppd file to %s' %ppdFile)
-				
-				# update permission on new file
-				if os.path.exists(ppdFile):
-					self.logger.info('Updating permissions on file %s' %ppdFile)
-					try:
-						chmod = subprocess.call(['chmod', '644', ppdFile])
-					except subprocess.CalledProcessError:
-						self.logger.error('Could not change permission for file %s' %ppdFile)				
-					
-				# delete temp file
-				os.remove(newppdFile.name)
-				self.logger.info('Successfully deleted file %s' %newppdFile)
-			except IOError as (errCode, errMessage):
-				logger.error('Could not copy file %s to %s' %(newppdFile.name, ppdFile))	
-				logger.error('Error: %s Message: %s' %(errCode, errMessage))			
-		else:
-			self.logger.warn('ppd file %s does not exists' %ppdFile)
-		
-		self.logger.info('Successfully enabled duplex unit for printer %s' %printer)
-		return True		
-		
-	def setDefaultDuplexPrintingForHPPrinter(self, printer):
-		"""
-		Enables duplexing for HP printer
-		"""
-		self.logger.info('Enabling duplex printing for HP printer %s' %printer)
-		
-		# Update the driver ppd
-		ppdFile = os.path.join('/etc/cups/ppd', printer + '.ppd')
-		newppdFile = tempfile.NamedTemporaryFile(delete=False)
-		
-		self.logger.info('Checking if ppd file %s exists' %ppdFile)
-		if os.path.exists(ppdFile):
-			self.logger.info('ppd file %s exists' %ppdFile)
-			ppd = open(ppdFile, 'r')
-			for line in ppd:				
-				if line.startswith("*DefaultDuplex: None", 0, len("*DefaultDuplex: None")):
-					newppdFile.writelines('*DefaultDuplex: DuplexNoTumble\n')
-				elif line.startswith("*DefaultOptionDuplex: False", 0, len("*DefaultOptionDuplex: False")):
-					newppdFile.writelines('*DefaultOptionDuplex: True\n')
-				else:
-					newppdFile.writelines(line)
-			newppdFile.close()
-			ppd.close()
-			self.logger.info('successfully created file %s' %newppdFile.name)
-			try:				
-				shutil.copy(newppdFile.name, ppdFile)
-				self.logger.info('Successfully copied the modified ppd file to %s' %ppdFile)
-				
-				# update permission on new file
-				if os.path.exists(ppdFile):
-					self.logger.info('Updating permissions on file %s' %ppdFile)
-					try:
-						chmod = subprocess.call(['chmod', '644', ppdFile])
-					except subprocess.CalledProcessError:
-						self.logger.error('Could not change permission for file %s' %ppdFile)						
-					
-				# delete temp file
-				os.remove(newppdFile.name)
-				self.logger.info('Successfully deleted file %s' %newppdFile)
-			except IOError as (errCode, errMessage):
-				logger.error('Could not copy file %s to %s' %(newppdFile.name, ppdFile))	
-				logger.error('Error: %s Message: %s' %(errCode, errMessage))			
-		else:
-			self.logger.warn('ppd file %s does not exists' %ppdFile)
-		
-		self.logger.info('Successfully enabled duplexing for printer %s' %printer)
+		from ppdpatch import PPDFile, PPDError
+		ppdFile = os.path.join(cupsPPDDIR, printer + '.ppd')
+		self.logger.info('Patching ppd file %s' %ppdFile)
+		try:
+			ppd = PPDFile(self.logger, ppdFile).load()
+			ppd.apply(edits)
+			ppd.save()
+		except PPDError as e:
+			self.logger.error(e.message)
+			return False
 		return True
 			
-	def setDefaultDuplexPrinting(self, printer):
+	def setDefaultDuplexPrinting(self, printer, duplex='DuplexNoTumble'):
 		"""
-		Enables default duplex printing
+		Enables default duplex printing, or with an empty duplex removes the default duplex
+		option so the ppd default applies again
 		"""
 		self.logger.info('Setting default duplex printing for printer %s' %printer)
 		
-		enableDuplexCommand = ['lpoptions', '-p', printer, '-o', 'duplex=DuplexNoTumble']
-		self.logger.info('Enabling duplex printing for printer %s using command %s' %(printer, enableDuplexCommand))
+		if duplex:
+			enableDuplexCommand = ['lpoptions', '-p', printer, '-o', 'duplex=%s' %duplex]
+		else:
+			enableDuplexCommand = ['lpoptions', '-p', printer, '-r', 'duplex']
+		self.logger.info('Setting duplex printing for printer %s using command %s' %(printer, enableDuplexCommand))
 		try:
-			lpinfo = subprocess.check_output(enableDuplexCommand)
+			with lpoptionsLock:
+				lpinfo = subprocess.check_output(enableDuplexCommand)
 		except subprocess.CalledProcessError:
-			self.logger.error('Could not enable duplexing for printer %s' %printer)		
+			self.logger.error('Could not set duplexing for printer %s' %printer)		
 			return False
 		
 		self.logger.info('Successfully set default duplexing for printer %s' %printer)
@@ -355,27 +585,134 @@ class PrinterUtility:
 		returns all printers by queue backend
 		e.g. lpd, usb, socket, etc.
 		"""
-		allPrinters = {}
 		self.logger.info('Getting list of all printers by queue backend type')
-		queryPrinterCommand = ['lpstat', '-p']
-		printersList = []
-		self.logger.info('Querying printers using command %s' %queryPrinterCommand)
-		try:
-			lpstat = subprocess.check_output(queryPrinterCommand)
-			printersStat = lpstat.split('\n')
-			for printerStat in printersStat:
-				if re.match('^printer\s(?P<printer>[\w\s]+)\sis[\w\s]+', printerStat):
-					printersList.append(re.match('^printer\s(?P<printer>[\w\s]+)\sis[\w\s]+', printerStat).group('printer'))
-			self.logger.info('All printers = %s' %printersList)
-		except subprocess.CalledProcessError:
-			self.logger.error('Could not query all printers printer using lpstat')		
-		
-		if len(printersList) > 0:
-			for printer in printersList:
-				allPrinters[printer] = self.queryPrinterOption(printer, option='all')
+		allPrinters = self.getPrinterSnapshot().printers
 		self.logger.info('All printer = %s' %allPrinters)
 		return allPrinters
+
+	def getPrinterSnapshot(self):
+		"""
+		Returns a PrinterSnapshot of all print queues. cupsd is asked for all of them in one
+		IPP request. Without IPP the CUPS printers.conf is parsed when it can be read (as root),
+		otherwise a single lpstat -v call gives the device URI of every queue. The options in
+		the CUPS lpoptions file are added
+		"""
+		printers = None
+		ipp = self.getIPPClient()
+		if ipp:
+			from ippclient import IPPError
+			try:
+				printers = {}
+				for printer, attributes in ipp.getPrinters(printersConfigAttributes.values()).items():
+					printers[printer] = dict([(name, formatAttributeValue(value)) for name, value in attributes.items()])
+			except IPPError as e:
+				if not self.ippFailed(e):
+					self.logger.warn('Could not list printers using IPP: %s' %e.message)
+				printers = None
+		if printers is None:
+			try:
+				printers = self.readPrintersConfig(cupsPrintersConfigFile)
+			except IOError as e:
+				self.logger.info('Could not read %s (%s), querying device URIs using lpstat' %(cupsPrintersConfigFile, e))
+				printers = self.readDeviceURIs()
+		self.readPrinterOptions(cupsOptionsFile, printers)
+		self.logger.info('Read settings of %d printers' %len(printers))
+		return PrinterSnapshot(printers)
+
+	def readPrintersConfig(self, path):
+		"""
+		Parses the queues in a CUPS printers.conf into a dictionary of settings dictionaries,
+		using the attribute names lpoptions -p reports
+		"""
+		printers = {}
+		settings = None
+		printersConfig = open(path, 'r')
+		try:
+			for line in printersConfig:
+				line = line.strip()
+				if not line or line.startswith('#'):
+					continue
+				match = re.match('^<(Default)?Printer\s+(?P<printer>[^>]+)>$', line)
+				if match:
+					settings = {'printer-name': match.group('printer')}
+					if match.group(1):
+						settings['printer-is-default'] = 'true'
+					printers[match.group('printer')] = settings
+					continue
+				if line.startswith('</'):
+					settings = None
+					continue
+				if settings is None:
+					continue
+				parts = line.split(None, 1)
+				keyword = parts[0]
+				value = len(parts) > 1 and parts[1] or ''
+				if keyword == 'Option':
+					option = value.split(None, 1)
+					settings[option[0]] = len(option) > 1 and option[1] or ''
+				elif keyword == 'State':
+					settings['printer-state'] = printerStateValues.get(value.lower(), value)
+				elif keyword in ('Accepting', 'Shared'):
+					settings[printersConfigAttributes[keyword]] = value.lower() in ('yes', 'true', 'on') and 'true' or 'false'
+				elif keyword in printersConfigAttributes:
+					settings[printersConfigAttributes[keyword]] = value
+		finally:
+			printersConfig.close()
+		return printers
+
+	def readPrinterOptions(self, path, printers):
+		"""
+		Adds the server wide default options that lpoptions -p saves in the CUPS lpoptions file
+		to the settings of the queues
+		"""
+		import shlex
+		try:
+			optionsFile = open(path, 'r')
+		except IOError:
+			return
+		try:
+			for line in optionsFile:
+				try:
+					parts = shlex.split(line)
+				except ValueError:
+					continue
+				if len(parts) < 2 or parts[0] not in ('Dest', 'Default'):
+					continue
+				# An instance (queue/instance) has options of its own
+				if parts[1] not in printers:
+					continue
+				for option in parts[2:]:
+					if '=' in option:
+						printers[parts[1]][option.split('=', 1)[0]] = option.split('=', 1)[1]
+		finally:
+			optionsFile.close()
+
+	def readDeviceURIs(self):
+		"""
+		Returns the device URI of every queue from one lpstat -v call
+		"""
+		printers = {}
+		try:
+			lpstat = subprocess.check_output(['lpstat', '-v'], env=dict(os.environ, LC_ALL='C'))
+		except (OSError, subprocess.CalledProcessError):
+			self.logger.error('Could not query printer device URIs using lpstat')
+			return printers
+		for line in lpstat.split('\n'):
+			match = re.match('^device for (?P<printer>[^:]+):\s*(?P<uri>\S+)', line)
+			if match:
+				printers[match.group('printer')] = {'printer-name': match.group('printer'), 'device-uri': match.group('uri')}
+		return printers
 	
+	def getDriverIndex(self):
+		"""
+		Returns the index of the installed drivers. All lookups of an install run are
+		answered from one listing of the drivers
+		"""
+		if self.driverIndex is None:
+			from driverindex import DriverIndex
+			self.driverIndex = DriverIndex(self.logger).load()
+		return self.driverIndex
+
 	def isDriverInstalled(self, printerModel, printerDriver):
 		"""
 		Checks if the given driver for the given printer model is installed on the system
@@ -394,30 +731,7 @@ class PrinterUtility:
 				printerDriver = re.sub('\)', '\)', printerDriver)
 				self.logger.info('Printer driver after fixing brackets: %s' %printerDriver)
 		
-		try:
-			lpinfo = subprocess.check_output(['lpinfo', '--make-and-model', printerModel, '-m'])
-		except subprocess.CalledProcessError:
-			self.logger.error('Could not get printer driver details using lpinfo')		
-			return printerDriverPath
-			
-		# Process results of lpinfo
-		driversList = lpinfo.split('\n')
-		self.logger.info('Total %d drivers returned for <%s> make and model' %(len(driversList), printerModel))
-		for driver in driversList:
-			driverPath = driver.split(' ')[0]
-			driverName = driver.lstrip(driverPath)
-			# remove white spaces if any
-			driverPath = driverPath.strip()
-			driverName = driverName.strip()
-			if driverName != '':
-				self.logger.info('checking if driver <%s> matches <%s>' %(driverName, printerDriver))
-				if re.search(printerDriver, driverName):
-					self.logger.info('Driver matches')
-					driverFound = True
-					printerDriverPath = driverPath
-					break
-				else:
-					self.logger.info('Driver %s does not match' %driverName)
+		printerDriverPath = self.getDriverIndex().findDriver(printerModel, printerDriver)
 		
 		self.logger.info('Returing driver path %s' %printerDriverPath)
 		return printerDriverPath
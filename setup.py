@@ -4,7 +4,8 @@
 #	This script will install pharos remote printing on the system.
 #	The following tasks will be performed:
 #	1. Install the pharos backend to cups backend directory
-#	2. Install the popup scripts to /usr/local/bin/pharospopup
+#	2. Install the popup scripts to /usr/local/bin/pharospopup, the popup broker service and
+#	   the LPD server health daemon service
 #	3. Install the config file to /usr/local/etc/
 #	4. Install the uninstall script to /usr/local/bin/uninstall-pharos
 #	5. Setup the users desktop environment to autorun the pharospoup at login
@@ -13,6 +14,10 @@
 # Usage: 
 #	$sudo python setup.py
 #		This will install pharos remote printing
+#	$sudo python setup.py --reconcile [--dry-run] [--prune]
+#		This will only create and modify the print queues that differ from printers.conf.
+#		With --prune pharos print queues printers.conf does not define are deleted. With
+#		--dry-run the changes are listed and not made
 #
 # Author: Junaid Ali
 # Version: 1.0
@@ -24,13 +29,22 @@ import logging
 import subprocess
 import re
 import shutil
+import stat
 import ConfigParser
 import curses
+import time
+import Queue
+import threading
+import optparse
 
 # Script Variables ======================
 logFile = os.path.join(os.getcwd(), 'pharos-linux.log')
 pharosBackendFileName = 'pharos'
 pharosPopupServerFileName = 'pharospopup'
+pharosBrokerFileName = 'pharosbroker'
+pharosBrokerServiceName = 'pharosbroker.service'
+pharosHealthDaemonFileName = 'pharoshealthd'
+pharosHealthDaemonServiceName = 'pharoshealthd.service'
 pharosConfigFileName = 'pharos.conf'
 printersConfigFile = os.path.join(os.getcwd(), 'printers.conf')
 uninstallFile = 'pharos-uninstall'
@@ -38,10 +52,15 @@ uninstallFile = 'pharos-uninstall'
 popupServerInstallDIR = '/usr/local/bin'
 pharosConfigInstallDIR = '/usr/local/etc'
 pharosUninstallerDIR = '/usr/local/bin'
+systemdUnitDIR = '/etc/systemd/system'
 uninstallerSharedLibraryDIR = '/usr/local/lib/pharos'
 pharosLogDIR = '/var/log/pharos'
-programLogFiles = ['pharos.log', 'pharospopup.log']
-uninstallerSharedLibraryFiles = ['pharosuninstall.pyc', 'printerutils.pyc', 'processutils.pyc']
+pharosCacheDIR = '/var/cache/pharos'
+# Print queues installed at the same time, [Printers] workers in printers.conf overrides it
+printQueueInstallWorkers = 4
+programLogFiles = ['pharos.log', 'pharospopup.log', 'pharosbroker.log', 'pharoshealthd.log', 'pharos-trace.log']
+uninstallerSharedLibraryFiles = ['pharosuninstall.pyc', 'printerutils.pyc', 'processutils.pyc', 'ippclient.pyc']
+pharosSharedLibraryFiles = ['lpdclient.py', 'jobspool.py', 'pharosconfig.py', 'pharoslogging.py', 'jobtrace.py', 'popupprotocol.py', 'popupgui.py', 'lpdhealth.py']
 
 # Regular Expressions
 gnomeWindowManagerRegularExpression = 'gnome|unity'
@@ -103,14 +122,42 @@ def installBackend():
 		logger.error('Could not copy file %s to %s' %(backendFile, backendDIR))
 		uninstallAndExit()
 	
-	# Set execution bits for backend files
-	logger.info('Set execution bit on the backend files')
+	# Set execution bit for the backend file. The backend runs unprivileged as lp and reaches the
+	# popup servers in the users' sessions through the popup broker
+	logger.info('Set execution bit on the backend file')
 	try:
-		chmod = subprocess.check_output(['chmod', '755', os.path.join(backendDIR, pharosBackendFileName), os.path.join(backendDIR, 'lpd')])
+		chmod = subprocess.check_output(['chmod', '755', os.path.join(backendDIR, pharosBackendFileName)])
 	except subprocess.CalledProcessError:
-		logger.error('Could not change the execution bit on backend files: %s, %s' %(os.path.join(backendDIR, pharosBackendFileName), os.path.join(backendDIR, 'lpd')))		
+		logger.error('Could not change the execution bit on backend file: %s' %os.path.join(backendDIR, pharosBackendFileName))		
 		uninstallAndExit()
-	logger.info('Successfully setup the execution bit on backend files: %s, %s' %(os.path.join(backendDIR, pharosBackendFileName), os.path.join(backendDIR, 'lpd')))
+	logger.info('Successfully setup the execution bit on backend file: %s' %os.path.join(backendDIR, pharosBackendFileName))
+
+def installSharedLibraries():
+	"""
+	Install the python modules shared by the backend and popup server
+	"""
+	logger.info('Installing shared library files to %s' %uninstallerSharedLibraryDIR)
+	if not os.path.exists(uninstallerSharedLibraryDIR):
+		logger.info('Trying to create directroy %s' %uninstallerSharedLibraryDIR)
+		try:
+			os.makedirs(uninstallerSharedLibraryDIR)
+			logger.info('Successfully created directory %s' %uninstallerSharedLibraryDIR)
+		except OSError as (errCode, errMessage):
+			logger.error('Could not create directory %s' %uninstallerSharedLibraryDIR)
+			logger.error('Error: %s Message: %s' %(errCode, errMessage))
+			uninstallAndExit()
+	
+	for libraryFile in pharosSharedLibraryFiles:
+		fullPath = os.path.join(os.getcwd(), libraryFile)
+		logger.info('Copying file %s to %s' %(fullPath, uninstallerSharedLibraryDIR))
+		try:
+			shutil.copy(fullPath, uninstallerSharedLibraryDIR)
+			os.chmod(os.path.join(uninstallerSharedLibraryDIR, libraryFile), 0644)
+			logger.info('Successfully copied file %s to %s' %(fullPath, uninstallerSharedLibraryDIR))
+		except (IOError, OSError) as (errCode, errMessage):
+			logger.error('Could not copy file %s to %s' %(fullPath, uninstallerSharedLibraryDIR))
+			logger.error('Error: %s Message: %s' %(errCode, errMessage))
+			uninstallAndExit()
 
 def installPopupServer():
 	"""
@@ -138,6 +185,85 @@ def installPopupServer():
 		logger.error('Error: %s Message: %s' %(errCode, errMessage))
 		uninstallAndExit()
 	
+def installBroker():
+	"""
+	Installs the popup broker and starts it as a systemd service
+	"""
+	logger.info('Installing popup broker')
+	brokerExecutable = os.path.join(os.getcwd(), pharosBrokerFileName)
+	try:
+		logger.info('Trying to copy %s to %s' %(brokerExecutable, popupServerInstallDIR))
+		shutil.copy(brokerExecutable, popupServerInstallDIR)
+		os.chmod(os.path.join(popupServerInstallDIR, pharosBrokerFileName), 0755)
+		logger.info('Successfully copied %s to %s' %(brokerExecutable, popupServerInstallDIR))
+	except (IOError, OSError) as (errCode, errMessage):
+		logger.error('Could not copy file %s to %s' %(brokerExecutable, popupServerInstallDIR))
+		logger.error('Error: %s Message: %s' %(errCode, errMessage))
+		uninstallAndExit()
+
+	if not os.path.isdir(systemdUnitDIR):
+		logger.warn('systemd not found. Start %s at boot to route print jobs on multi-user machines' %os.path.join(popupServerInstallDIR, pharosBrokerFileName))
+		return
+	serviceFile = os.path.join(systemdUnitDIR, pharosBrokerServiceName)
+	logger.info('Writing service file %s' %serviceFile)
+	serviceHandle = open(serviceFile, 'w')
+	serviceHandle.write('[Unit]\n')
+	serviceHandle.write('Description=Pharos remote printing popup broker\n')
+	serviceHandle.write('Before=cups.service\n\n')
+	serviceHandle.write('[Service]\n')
+	serviceHandle.write('ExecStart=%s\n' %os.path.join(popupServerInstallDIR, pharosBrokerFileName))
+	serviceHandle.write('Restart=on-failure\n\n')
+	serviceHandle.write('[Install]\n')
+	serviceHandle.write('WantedBy=multi-user.target\n')
+	serviceHandle.close()
+	try:
+		subprocess.check_output(['systemctl', 'daemon-reload'])
+		subprocess.check_output(['systemctl', 'enable', pharosBrokerServiceName])
+		subprocess.check_output(['systemctl', 'restart', pharosBrokerServiceName])
+		logger.info('Successfully started %s' %pharosBrokerServiceName)
+	except (OSError, subprocess.CalledProcessError) as e:
+		logger.error('Could not start %s. Error: %s' %(pharosBrokerServiceName, e))
+
+def installHealthDaemon():
+	"""
+	Installs the LPD server health daemon and starts it as a systemd service
+	"""
+	logger.info('Installing LPD server health daemon')
+	healthDaemonExecutable = os.path.join(os.getcwd(), pharosHealthDaemonFileName)
+	try:
+		logger.info('Trying to copy %s to %s' %(healthDaemonExecutable, popupServerInstallDIR))
+		shutil.copy(healthDaemonExecutable, popupServerInstallDIR)
+		os.chmod(os.path.join(popupServerInstallDIR, pharosHealthDaemonFileName), 0755)
+		logger.info('Successfully copied %s to %s' %(healthDaemonExecutable, popupServerInstallDIR))
+	except (IOError, OSError) as (errCode, errMessage):
+		logger.error('Could not copy file %s to %s' %(healthDaemonExecutable, popupServerInstallDIR))
+		logger.error('Error: %s Message: %s' %(errCode, errMessage))
+		uninstallAndExit()
+
+	if not os.path.isdir(systemdUnitDIR):
+		logger.warn('systemd not found. Start %s at boot to keep the LPD server health up to date' %os.path.join(popupServerInstallDIR, pharosHealthDaemonFileName))
+		return
+	serviceFile = os.path.join(systemdUnitDIR, pharosHealthDaemonServiceName)
+	logger.info('Writing service file %s' %serviceFile)
+	serviceHandle = open(serviceFile, 'w')
+	serviceHandle.write('[Unit]\n')
+	serviceHandle.write('Description=Pharos remote printing LPD server health daemon\n')
+	serviceHandle.write('Wants=network-online.target\n')
+	serviceHandle.write('After=network-online.target\n\n')
+	serviceHandle.write('[Service]\n')
+	serviceHandle.write('ExecStart=%s\n' %os.path.join(popupServerInstallDIR, pharosHealthDaemonFileName))
+	serviceHandle.write('Restart=on-failure\n\n')
+	serviceHandle.write('[Install]\n')
+	serviceHandle.write('WantedBy=multi-user.target\n')
+	serviceHandle.close()
+	try:
+		subprocess.check_output(['systemctl', 'daemon-reload'])
+		subprocess.check_output(['systemctl', 'enable', pharosHealthDaemonServiceName])
+		subprocess.check_output(['systemctl', 'restart', pharosHealthDaemonServiceName])
+		logger.info('Successfully started %s' %pharosHealthDaemonServiceName)
+	except (OSError, subprocess.CalledProcessError) as e:
+		logger.error('Could not start %s. Error: %s' %(pharosHealthDaemonServiceName, e))
+
 def addPopupServerToGnomeSession():
 	"""
 	Adds the popup server to gnome session
@@ -312,36 +438,223 @@ def addPopupServerToLogin():
 		logger.warn('Users window manager is not recognized. Could not setup login scripts for popupserver. Please use your window manager to add startup script %s' %os.path.join(os.getcwd(),pharosPopupServerFileName))
 	logger.info('Completed adding pharos popup server to login')
 	
-def installPrintQueuesUsingConfigFile():
+def readPrinterDefinitions():
 	"""
-	Installs print queues based on the printers.conf file
+	Reads the printers.conf file and returns the config, the list of printers to install
+	and the number of workers installing them
 	"""
-	logger.info('Installing print queues using config file %s' %printersConfigFile)
 	config = ConfigParser.RawConfigParser()
 	config.read(printersConfigFile)
 	printersList = config.get('Printers','printers')
 	logger.info('Printers list = %s' %printersList)
-	printers = printersList.split(',')
+	printers = []
+	for printer in printersList.split(','):
+		printer = printer.strip()
+		if printer and printer not in printers:
+			printers.append(printer)
+	workers = printQueueInstallWorkers
+	if config.has_option('Printers', 'workers'):
+		workers = config.getint('Printers', 'workers')
+	return config, printers, workers
+
+def getPrinterProperties(config, printer):
+	"""
+	Returns the properties of a printer defined in the config file as a dictionary
+	"""
+	printerProperties = config.items(printer)			
+	# convert to dictionary
+	printerPropertiesDictionary = {'printqueue': printer}
+	for pproperty in printerProperties:				
+		printerPropertiesDictionary[pproperty[0]] = pproperty[1]			
+	return printerPropertiesDictionary
+
+def installPrintQueuesUsingConfigFile():
+	"""
+	Installs print queues based on the printers.conf file. The queues are installed by a
+	pool of worker threads, each with its own connection to cupsd
+	"""
+	logger.info('Installing print queues using config file %s' %printersConfigFile)
+	config, printers, workers = readPrinterDefinitions()
 	logger.info('Need to install total %d printers' %len(printers))
+	tasks = []
 	for printer in printers:
-		printer = printer.strip()
-		logger.info('Installing printer %s' %printer)
-		print('Installing printer %s' %printer)
-		# Verfiy section
-		if config.has_section(printer):
-			logger.info('Printer %s is defined in config file' %printer)
-			printerProperties = config.items(printer)			
-			# convert to dictionary
-			printerPropertiesDictionary = {'printqueue': printer}
-			for pproperty in printerProperties:				
-				printerPropertiesDictionary[pproperty[0]] = pproperty[1]			
-			if (printerUtility.installPrintQueue(printerPropertiesDictionary)):
-				logger.info('Successfully installed printer %s' %printer)
-			else:
-				logger.warn('Could not install printer %s as driver is missing' %printer)
+		tasks.append(('install', printer, lambda utility, printer=printer: installPrintQueue(utility, config, printer)))
+	runPrintQueueTasks(tasks, workers)
+
+def runPrintQueueTasks(tasks, workers):
+	"""
+	Runs the (action, printer, function) tasks on a pool of worker threads. Each function is
+	called with the PrinterUtility of its worker and returns True when it succeeded. Prints
+	the outcome and time of every task and a summary
+	"""
+	if not tasks:
+		return
+	workers = max(1, min(workers, len(tasks)))
+	# The driver index is loaded once and shared by the workers
+	printerUtility.getDriverIndex()
+	pendingTasks = Queue.Queue()
+	for task in tasks:
+		pendingTasks.put(task)
+	results = {}
+	started = time.time()
+	logger.info('Running %d print queue tasks using %d workers' %(len(tasks), workers))
+	runners = []
+	for worker in range(workers):
+		runner = threading.Thread(target=runPrintQueueWorker, args=(pendingTasks, results))
+		runner.setDaemon(True)
+		runner.start()
+		runners.append(runner)
+	for runner in runners:
+		runner.join()
+	
+	# Summary
+	done = [(action, printer) for action, printer, function in tasks if results.get(printer, (False, 0))[0]]
+	logger.info('Print queue task times: %s' %', '.join(['%s %s %.2f s' %(action, printer, results.get(printer, (False, 0))[1]) for action, printer, function in tasks]))
+	summary = 'Completed %d of %d print queue tasks in %.1f s using %d workers' %(len(done), len(tasks), time.time() - started, workers)
+	logger.info(summary)
+	print(summary)
+	failed = ['%s %s' %(action, printer) for action, printer, function in tasks if (action, printer) not in done]
+	if failed:
+		logger.warn('Failed print queue tasks: %s' %', '.join(failed))
+		print('Failed print queue tasks: %s' %', '.join(failed))
+
+def runPrintQueueWorker(pendingTasks, results):
+	"""
+	Worker running tasks from the pendingTasks queue until it is empty. The result of each
+	printer is stored in results as (succeeded, seconds taken)
+	"""
+	workerUtility = PrinterUtility(logger)
+	workerUtility.driverIndex = printerUtility.getDriverIndex()
+	while 1:
+		try:
+			action, printer, function = pendingTasks.get_nowait()
+		except Queue.Empty:
+			break
+		started = time.time()
+		try:
+			succeeded = function(workerUtility)
+		except Exception:
+			logger.exception('Unexpected error in %s of printer %s' %(action, printer))
+			succeeded = False
+		results[printer] = (succeeded, time.time() - started)
+		print('%s printer %s: %s (%.1f s)' %(action, printer, succeeded and 'done' or 'failed', results[printer][1]))
+	workerUtility.close()
+
+def installPrintQueue(utility, config, printer):
+	"""
+	Installs one printer defined in the config file. Returns True when it was installed
+	"""
+	logger.info('Installing printer %s' %printer)
+	# Verfiy section
+	if config.has_section(printer):
+		logger.info('Printer %s is defined in config file' %printer)
+		if (utility.installPrintQueue(getPrinterProperties(config, printer))):
+			logger.info('Successfully installed printer %s' %printer)
+			return True
 		else:
+			logger.warn('Could not install printer %s as driver is missing' %printer)
+	else:
+		logger.error('Printer %s is not defined in config file. Cannot install it' %printer)
+	return False
+
+def modifyPrintQueue(utility, config, printer, differences):
+	"""
+	Changes the differences between the installed print queue and its definition in the
+	config file, leaving the rest of the queue alone. Returns True when all were changed
+	"""
+	printerProperties = getPrinterProperties(config, printer)
+	fingerprint = utility.getPrintQueueFingerprint(printerProperties)
+	if fingerprint is None:
+		return False
+	modified = True
+	attributes = {}
+	for key, argument in [('device-uri', 'deviceURI'), ('printer-location', 'location'), ('printer-info', 'info')]:
+		if key in differences:
+			attributes[argument] = fingerprint[key]
+	if attributes:
+		modified = utility.modifyPrintQueue(printer, **attributes) and modified
+	if 'ppd' in differences:
+		# Edits no longer wanted are undone before the wanted ones are made
+		edits = [(keyword, value, oldValue) for keyword, oldValue, value in differences['ppd'][0] if (keyword, oldValue, value) not in fingerprint['ppd']]
+		modified = utility.patchPrinterPPD(printer, edits + list(fingerprint['ppd'])) and modified
+	if 'duplex' in differences:
+		modified = utility.setDefaultDuplexPrinting(printer, fingerprint['duplex']) and modified
+	return modified
+
+def planReconcile(prune=False):
+	"""
+	Compares the fingerprint of every printer defined in printers.conf with the installed
+	print queue and returns the plan: (action, printer, differences) for every printer,
+	where action is create, reinstall, modify, delete, keep, unchanged or skip, and the
+	number of workers. Pharos print queues printers.conf does not define are only deleted
+	with prune, as an administrator may have added them by hand
+	"""
+	config, printers, workers = readPrinterDefinitions()
+	snapshot = printerUtility.getPrinterSnapshot()
+	plan = []
+	for printer in printers:
+		if not config.has_section(printer):
 			logger.error('Printer %s is not defined in config file. Cannot install it' %printer)
-	
+			plan.append(('skip', printer, 'not defined in %s' %os.path.basename(printersConfigFile)))
+			continue
+		printerProperties = getPrinterProperties(config, printer)
+		fingerprint = printerUtility.getPrintQueueFingerprint(printerProperties)
+		if fingerprint is None:
+			plan.append(('skip', printer, 'driver not installed'))
+			continue
+		if printer not in snapshot:
+			plan.append(('create', printer, 'fingerprint %s' %getFingerprintDigest(fingerprint)))
+			continue
+		installed = printerUtility.getInstalledFingerprint(printerProperties, snapshot.get(printer), fingerprint)
+		differences = {}
+		for key in fingerprint:
+			if key in installed and installed[key] != fingerprint[key]:
+				differences[key] = (installed[key], fingerprint[key])
+		logger.info('Printer %s fingerprint %s, installed %s' %(printer, getFingerprintDigest(fingerprint), getFingerprintDigest(installed)))
+		if not differences:
+			plan.append(('unchanged', printer, None))
+		elif 'printer-make-and-model' in differences:
+			# A new driver brings a new ppd, the queue is installed again
+			plan.append(('reinstall', printer, differences))
+		else:
+			plan.append(('modify', printer, differences))
+	for printer in snapshot.printersWithScheme('pharos'):
+		if printer not in printers and prune:
+			plan.append(('delete', printer, None))
+		elif printer not in printers:
+			plan.append(('keep', printer, 'not defined in %s, --prune deletes it' %os.path.basename(printersConfigFile)))
+	return config, plan, workers
+
+def reconcilePrintQueues(dryRun=False, prune=False):
+	"""
+	Creates, modifies and, with prune, deletes only the pharos print queues that differ from
+	their definition in printers.conf. With dryRun the plan is printed and nothing is changed
+	"""
+	logger.info('Reconciling print queues with config file %s' %printersConfigFile)
+	config, plan, workers = planReconcile(prune)
+	tasks = []
+	for action, printer, differences in plan:
+		print('%-9s %s' %(action, printer))
+		if isinstance(differences, dict):
+			for key in sorted(differences.keys()):
+				print('          %s: %r -> %r' %(key, differences[key][0], differences[key][1]))
+		elif differences:
+			print('          %s' %differences)
+		logger.info('Reconcile plan: %s %s %s' %(action, printer, differences or ''))
+		if action in ('create', 'reinstall'):
+			tasks.append((action, printer, lambda utility, printer=printer: installPrintQueue(utility, config, printer)))
+		elif action == 'modify':
+			tasks.append((action, printer, lambda utility, printer=printer, differences=differences: modifyPrintQueue(utility, config, printer, differences)))
+		elif action == 'delete':
+			tasks.append((action, printer, lambda utility, printer=printer: utility.deletePrinter(printer)))
+	if dryRun:
+		print('Dry run: %d print queue changes planned, nothing changed' %len(tasks))
+		return
+	if not tasks:
+		print('All print queues are up to date')
+		return
+	runPrintQueueTasks(tasks, workers)
+
 def setupLoggingDirectories():
 	"""
 	Setup the permissions for log folders
@@ -365,10 +678,11 @@ def setupLoggingDirectories():
 	else:
 		logger.info('Autostart directory %s already exists' %pharosLogDIR)
 	
-	# Setup permissions for all users
+	# Setup permissions for all users. The sticky bit keeps users from replacing the log files
+	# of other users and of the root daemons, so the logs are rotated by copying, not renaming
 	logger.info('Changing permission for directory %s' %pharosLogDIR)
 	try:
-		chmod = subprocess.check_output(['chmod', '777', pharosLogDIR])
+		chmod = subprocess.check_output(['chmod', '1777', pharosLogDIR])
 		logger.info('Successfully updated permissions for %s' %pharosLogDIR)
 	except CalledProcessError as (errCode, errMessage):
 		logger.error('Could not set permissions for %s' %pharosLogDIR)	
@@ -387,6 +701,33 @@ def setupLoggingDirectories():
 			logger.error('Could not set permissions for %s' %s.path.join(pharosLogDIR, lfile))	
 			logger.error('Error: %s Message: %s' %(errCode, errMessage))
 	
+def setupCacheDirectory():
+	"""
+	Creates the cache directory and pre-builds the cache of the installed program config file
+	"""
+	logger.info('Creating cache directory %s' %pharosCacheDIR)
+	if not os.path.exists(pharosCacheDIR):
+		os.makedirs(pharosCacheDIR)
+	# Only root writes the caches, root processes must not load a cache another user wrote
+	os.chown(pharosCacheDIR, 0, 0)
+	os.chmod(pharosCacheDIR, 0755)
+	for cacheFileName in os.listdir(pharosCacheDIR):
+		cachePath = os.path.join(pharosCacheDIR, cacheFileName)
+		st = os.lstat(cachePath)
+		if st.st_uid != 0:
+			logger.warn('Removing cache file %s not owned by root' %cachePath)
+			if stat.S_ISDIR(st.st_mode):
+				shutil.rmtree(cachePath)
+			else:
+				os.remove(cachePath)
+	
+	from pharosconfig import PharosConfig
+	config = PharosConfig(os.path.join(pharosConfigInstallDIR, pharosConfigFileName), pharosCacheDIR).load()
+	if os.path.exists(config.cachePath):
+		logger.info('Successfully created config cache %s' %config.cachePath)
+	else:
+		logger.warn('Could not create config cache %s. Programs will parse %s on every start' %(config.cachePath, config.path))
+
 def installUninstaller():
 	"""
 	Setup the uninstaller
@@ -524,6 +865,19 @@ def main():
 	"""
 	logger.info('Beginning %s' %sys.argv[0])
 	
+	parser = optparse.OptionParser(usage='%prog [--reconcile [--dry-run] [--prune]]')
+	parser.add_option('--reconcile', action='store_true', default=False, help='only apply the differences between printers.conf and the installed print queues')
+	parser.add_option('--dry-run', dest='dryRun', action='store_true', default=False, help='with --reconcile, list the changes without making them')
+	parser.add_option('--prune', action='store_true', default=False, help='with --reconcile, also delete the pharos print queues printers.conf does not define')
+	options, args = parser.parse_args()
+	if options.dryRun and not options.reconcile:
+		parser.error('--dry-run requires --reconcile')
+	if options.prune and not options.reconcile:
+		parser.error('--prune requires --reconcile')
+	if options.reconcile:
+		reconcilePrintQueues(options.dryRun, options.prune)
+		return
+	
 	if os.path.exists(os.path.join(os.getcwd(), 'EULA')):
 		logger.info('The EULA file exists. Will prompt user for accepting EULA')
 		if not acceptEULA(os.path.join(os.getcwd(), 'EULA')):
@@ -537,6 +891,10 @@ def main():
 	print('Checking for drivers')
 	checkDrivers()
 	
+	# Install shared libraries used by the backend and popup server
+	print('Installing shared libraries')	
+	installSharedLibraries()
+	
 	# Install backend
 	print('Installing backend')	
 	installBackend()
@@ -553,6 +911,18 @@ def main():
 	print('Setting up log directories')	
 	setupLoggingDirectories()
 	
+	# Setup the config cache
+	print('Setting up cache directory')	
+	setupCacheDirectory()
+	
+	# Install the popup broker, after the logging and cache directories it uses
+	print('Installing popup broker')	
+	installBroker()
+	
+	# Install the LPD server health daemon
+	print('Installing LPD server health daemon')	
+	installHealthDaemon()
+	
 	# Setup Print Queues
 	print('Installing printer queues')	
 	installPrintQueuesUsingConfigFile()
@@ -584,7 +954,7 @@ logger.addHandler(ch)
 # import the pharosuninstall file
 sys.path.append(os.getcwd())
 try:	
-	from printerutils import PrinterUtility
+	from printerutils import PrinterUtility, getFingerprintDigest
 except:
 	logger.error('Cannot import module printerutil')	
 	sys.exit(1)
@@ -0,0 +1,262 @@
+#!/usr/bin/python2
+# Script Name: test_ippclient.py
+# Script Function:
+#	This script tests ippclient.py against a stand-in IPP server on a Unix socket. The
+#	stand-in decodes each HTTP POST with the IPP request in it and answers with the scripted
+#	responses of the test, so the encoding, the kept-alive connection, the retry after cupsd
+#	closed it and the 401 authorization of the client are checked without a cupsd
+#
+# Usage:
+#	$python -m unittest discover -s tests
+#
+# Author: Junaid Ali
+# Version: 1.0
+
+# Imports ===============================
+import os
+import sys
+import shutil
+import socket
+import struct
+import logging
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ippclient
+from ippclient import IPPClient, IPPError, encodeAttribute, decodeResponse
+
+# Function Declaration ==================
+def encodeResponse(requestID, status, groups):
+	"""
+	Returns an IPP response with the status and (group tag, [(value tag, name, value)]) groups
+	"""
+	body = [struct.pack('!BBHi', 2, 0, status, requestID), chr(ippclient.IPP_TAG_OPERATION)]
+	body.append(encodeAttribute(ippclient.IPP_TAG_CHARSET, 'attributes-charset', 'utf-8'))
+	body.append(encodeAttribute(ippclient.IPP_TAG_LANGUAGE, 'attributes-natural-language', 'en'))
+	for tag, attributes in groups:
+		body.append(chr(tag))
+		for valueTag, name, value in attributes:
+			body.append(encodeAttribute(valueTag, name, value))
+	body.append(chr(ippclient.IPP_TAG_END))
+	return ''.join(body)
+
+def printerGroup(name, location):
+	"""
+	Returns the printer attributes group of a queue
+	"""
+	return (ippclient.IPP_TAG_PRINTER, [
+		(ippclient.IPP_TAG_NAME, 'printer-name', name),
+		(ippclient.IPP_TAG_TEXT, 'printer-location', location),
+		(ippclient.IPP_TAG_ENUM, 'printer-state', ippclient.IPP_PRINTER_IDLE),
+		(ippclient.IPP_TAG_BOOLEAN, 'printer-is-accepting-jobs', True),
+		(ippclient.IPP_TAG_KEYWORD, 'printer-state-reasons', ['none', 'paused']),
+	])
+
+# Class definitions =====================
+class StandInIPPServer:
+	"""
+	Answers IPP requests on a Unix socket, one connection at a time. Every request is
+	recorded as (HTTP headers, operation, groups) and answered by respond(), which returns
+	(HTTP status, IPP status, groups), None to close the connection without an answer, or a
+	complete raw HTTP response string
+	"""
+	def __init__(self, socketPath, respond):
+		"""
+		Constructor
+		"""
+		self.socketPath = socketPath
+		self.respond = respond
+		self.requests = []
+		self.connections = 0
+		self.s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.s.bind(socketPath)
+		self.s.listen(5)
+		self.thread = threading.Thread(target=self.run, name='ipp-stand-in')
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def run(self):
+		"""
+		Accepts connections until the listening socket is closed
+		"""
+		while True:
+			try:
+				client, address = self.s.accept()
+			except socket.error:
+				return
+			self.connections += 1
+			try:
+				self.serveConnection(client)
+			finally:
+				client.close()
+
+	def serveConnection(self, client):
+		"""
+		Answers the requests on one kept-alive connection
+		"""
+		data = ''
+		while True:
+			while '\r\n\r\n' not in data:
+				chunk = client.recv(65536)
+				if not chunk:
+					return
+				data += chunk
+			head, data = data.split('\r\n\r\n', 1)
+			headers = {}
+			for line in head.split('\r\n')[1:]:
+				headers[line.split(':', 1)[0].strip().lower()] = line.split(':', 1)[1].strip()
+			length = int(headers.get('content-length', 0))
+			while len(data) < length:
+				data += client.recv(65536)
+			body, data = data[:length], data[length:]
+			operation, groups = decodeResponse(body)
+			requestID = struct.unpack('!i', body[4:8])[0]
+			self.requests.append((headers, operation, groups))
+			response = self.respond(len(self.requests), headers, operation, groups)
+			if response is None:
+				return
+			if isinstance(response, str):
+				client.sendall(response)
+				continue
+			httpStatus, ippStatus, responseGroups = response
+			responseBody = ''
+			if httpStatus == 200:
+				responseBody = encodeResponse(requestID, ippStatus, responseGroups)
+			client.sendall('HTTP/1.1 %d Stand-in\r\nContent-Type: application/ipp\r\nContent-Length: %d\r\n\r\n%s' %(httpStatus, len(responseBody), responseBody))
+
+	def close(self):
+		"""
+		Stops accepting connections
+		"""
+		self.s.close()
+
+class IPPClientTest(unittest.TestCase):
+	"""
+	Tests of IPPClient against the stand-in IPP server
+	"""
+	def setUp(self):
+		self.tempDIR = tempfile.mkdtemp()
+		self.socketPath = os.path.join(self.tempDIR, 'cups.sock')
+		self.server = None
+		self.client = None
+
+	def tearDown(self):
+		if self.client:
+			self.client.close()
+		if self.server:
+			self.server.close()
+		shutil.rmtree(self.tempDIR)
+
+	def startServer(self, respond):
+		self.server = StandInIPPServer(self.socketPath, respond)
+		self.client = IPPClient(logging.getLogger('test'), self.socketPath, timeout=5)
+
+	def testGetPrintersDecodesAttributes(self):
+		self.startServer(lambda count, headers, operation, groups: (200, ippclient.IPP_STATUS_OK, [printerGroup('Q1', 'Annex'), printerGroup('Q2', '')]))
+		printers = self.client.getPrinters(['printer-location'])
+		self.assertEqual(sorted(printers.keys()), ['Q1', 'Q2'])
+		self.assertEqual(printers['Q1']['printer-location'], 'Annex')
+		self.assertEqual(printers['Q1']['printer-state'], ippclient.IPP_PRINTER_IDLE)
+		self.assertEqual(printers['Q1']['printer-is-accepting-jobs'], True)
+		self.assertEqual(printers['Q1']['printer-state-reasons'], ['none', 'paused'])
+		headers, operation, groups = self.server.requests[0]
+		self.assertEqual(operation, ippclient.IPP_OP_CUPS_GET_PRINTERS)
+		self.assertEqual(groups[0][1]['requested-attributes'], ['printer-location', 'printer-name'])
+
+	def testRequestsShareOneConnection(self):
+		self.startServer(lambda count, headers, operation, groups: (200, ippclient.IPP_STATUS_OK, []))
+		self.client.acceptJobs('Q1')
+		self.client.resumePrinter('Q1')
+		self.assertEqual(self.server.connections, 1)
+		self.assertEqual([request[1] for request in self.server.requests], [ippclient.IPP_OP_CUPS_ACCEPT_JOBS, ippclient.IPP_OP_RESUME_PRINTER])
+		self.assertEqual(self.server.requests[0][2][0][1]['printer-uri'], 'ipp://localhost/printers/Q1')
+
+	def testAddModifyPrinterEncodesPrinterAttributes(self):
+		self.startServer(lambda count, headers, operation, groups: (200, ippclient.IPP_STATUS_OK, []))
+		self.client.addModifyPrinter('Q 1', deviceURI='pharos://s/q', ppdName='drv', location=u'B\xfcro', info='', enable=True)
+		headers, operation, groups = self.server.requests[0]
+		self.assertEqual(operation, ippclient.IPP_OP_CUPS_ADD_MODIFY_PRINTER)
+		self.assertEqual(groups[0][1]['printer-uri'], 'ipp://localhost/printers/Q%201')
+		self.assertEqual(groups[0][1]['ppd-name'], 'drv')
+		self.assertEqual(groups[1][0], ippclient.IPP_TAG_PRINTER)
+		self.assertEqual(groups[1][1]['device-uri'], 'pharos://s/q')
+		self.assertEqual(groups[1][1]['printer-location'], 'B\xc3\xbcro')
+		self.assertEqual(groups[1][1]['printer-info'], '')
+		self.assertEqual(groups[1][1]['printer-is-accepting-jobs'], True)
+
+	def testUnauthorizedRequestIsRetriedWithAuthorization(self):
+		def respond(count, headers, operation, groups):
+			if 'authorization' not in headers:
+				return (401, 0, [])
+			return (200, ippclient.IPP_STATUS_OK, [])
+		self.startServer(respond)
+		self.client.deletePrinter('Q1')
+		self.assertEqual(len(self.server.requests), 2)
+		self.assertTrue('authorization' not in self.server.requests[0][0])
+		self.assertTrue(self.server.requests[1][0]['authorization'].split(' ')[0] in ('Local', 'PeerCred'))
+		# The authorization is kept for the following requests
+		self.client.acceptJobs('Q1')
+		self.assertEqual(len(self.server.requests), 3)
+		self.assertTrue('authorization' in self.server.requests[2][0])
+
+	def testRefusedAuthorizationRaises(self):
+		self.startServer(lambda count, headers, operation, groups: (401, 0, []))
+		try:
+			self.client.deletePrinter('Q1')
+		except IPPError, e:
+			self.assertEqual(e.reason, ippclient.IPP_ERROR_AUTH)
+		else:
+			self.fail('IPPError not raised')
+		self.assertEqual(len(self.server.requests), 2)
+
+	def testClosedConnectionIsRetriedOnce(self):
+		# The stand-in closes the kept-alive connection instead of answering the second request
+		self.startServer(lambda count, headers, operation, groups: count != 2 and (200, ippclient.IPP_STATUS_OK, []) or None)
+		self.client.acceptJobs('Q1')
+		self.client.resumePrinter('Q1')
+		self.assertEqual(self.server.connections, 2)
+		self.assertEqual([request[1] for request in self.server.requests], [ippclient.IPP_OP_CUPS_ACCEPT_JOBS, ippclient.IPP_OP_RESUME_PRINTER, ippclient.IPP_OP_RESUME_PRINTER])
+
+	def testConnectionClosedTwiceRaises(self):
+		self.startServer(lambda count, headers, operation, groups: None)
+		try:
+			self.client.acceptJobs('Q1')
+		except IPPError, e:
+			self.assertEqual(e.reason, ippclient.IPP_ERROR_IO)
+		else:
+			self.fail('IPPError not raised')
+		self.assertEqual(len(self.server.requests), 2)
+
+	def testMissingPrinterIsNone(self):
+		self.startServer(lambda count, headers, operation, groups: (200, ippclient.IPP_STATUS_NOT_FOUND, []))
+		self.assertEqual(self.client.getPrinterAttributes('Q9'), None)
+
+	def testFailedRequestRaisesStatus(self):
+		self.startServer(lambda count, headers, operation, groups: (200, 0x0400, []))
+		try:
+			self.client.deletePrinter('Q1')
+		except IPPError, e:
+			self.assertEqual(e.reason, ippclient.IPP_ERROR_STATUS)
+			self.assertEqual(e.status, 0x0400)
+		else:
+			self.fail('IPPError not raised')
+
+	def testChunkedResponse(self):
+		body = encodeResponse(1, ippclient.IPP_STATUS_OK, [printerGroup('Q1', 'Annex')])
+		chunked = '%x\r\n%s\r\n%x\r\n%s\r\n0\r\n\r\n' %(10, body[:10], len(body) - 10, body[10:])
+		self.startServer(lambda count, headers, operation, groups: 'HTTP/1.1 100 Continue\r\n\r\nHTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n' + chunked)
+		self.assertEqual(self.client.getPrinters([])['Q1']['printer-location'], 'Annex')
+
+	def testNoSocketRaisesConnect(self):
+		self.client = IPPClient(logging.getLogger('test'), os.path.join(self.tempDIR, 'missing.sock'))
+		try:
+			self.client.getPrinters([])
+		except IPPError, e:
+			self.assertEqual(e.reason, ippclient.IPP_ERROR_CONNECT)
+		else:
+			self.fail('IPPError not raised')
+
+if __name__ == '__main__':
+	unittest.main()